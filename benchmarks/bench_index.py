@@ -0,0 +1,199 @@
+"""
+Benchmark write_cdx_index() on synthetic WARC and ARC files across indexing
+modes, reporting records/sec, MB/sec and peak RSS for each mode.
+
+Each mode runs in a fresh process, so that peak RSS is per mode. Inputs are
+deterministic, and results are written as JSON with the current git commit,
+so that runs can be compared between commits:
+
+    python benchmarks/bench_index.py --captures 20000 --json before.json
+    git checkout other-branch
+    python benchmarks/bench_index.py --captures 20000 --compare before.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from cdxj_indexer.main import write_cdx_index
+
+# synth.py is next to this script, which may be run from any directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth import synth_file, parse_mix
+
+MODES = {
+    "cdxj": {},
+    "sort": {"sort": True},
+    "compress": {"sort": True, "compress": "{tmp}/index.cdxj.gz"},
+    "post-append": {"post_append": True},
+    # record digests are only computed when records are collected, as with
+    # post_append, or for compressed blocks
+    "digest-records": {"digest_records": True, "post_append": True},
+    "compress-digest": {
+        "sort": True,
+        "compress": "{tmp}/index.cdxj.gz",
+        "digest_records": True,
+    },
+    "cdx11": {"cdx11": True},
+}
+
+INPUTS = {
+    "warc.gz": "bench.warc.gz",
+    "warc": "bench.warc",
+    "arc.gz": "bench.arc.gz",
+}
+
+
+# ============================================================================
+def run_mode(input_path, opts, tmp_dir):
+    opts = dict(opts)
+    if "compress" in opts:
+        opts["compress"] = opts["compress"].format(tmp=tmp_dir)
+
+    output = os.path.join(tmp_dir, "index.cdxj")
+
+    start = time.perf_counter()
+    write_cdx_index(output, input_path, opts)
+    elapsed = time.perf_counter() - start
+
+    with open(output, "rb") as fh:
+        lines = sum(1 for line in fh)
+
+    os.remove(output)
+
+    # ru_maxrss is in kilobytes on linux, bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        maxrss *= 1024
+
+    return elapsed, lines, maxrss
+
+
+def run_isolated(input_path, opts, tmp_dir):
+    # a fresh interpreter, rather than a fork, so that peak RSS is not
+    # inherited from this process
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(run_mode, input_path, opts, tmp_dir).result()
+
+
+def get_git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(cmd, tmp_dir):
+    results = []
+
+    for input_name in cmd.inputs.split(","):
+        input_path = os.path.join(tmp_dir, INPUTS[input_name])
+        num_records = synth_file(
+            input_path, cmd.captures, cmd.mix, cmd.seed, cmd.payload_size
+        )
+        size = os.path.getsize(input_path)
+
+        for mode in cmd.modes.split(","):
+            # all measurements are from the fastest run
+            runs = [
+                run_isolated(input_path, MODES[mode], tmp_dir)
+                for i in range(cmd.repeat)
+            ]
+            best, lines, maxrss = min(runs)
+
+            result = {
+                "input": input_name,
+                "mode": mode,
+                "records": num_records,
+                "input_bytes": size,
+                "lines": lines,
+                "seconds": round(best, 4),
+                "records_per_sec": round(num_records / best, 1),
+                "mb_per_sec": round(size / best / 1024 / 1024, 2),
+                "peak_rss_mb": round(maxrss / 1024 / 1024, 1),
+            }
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def print_result(result, prev=None):
+    line = "{input:8} {mode:15} {records_per_sec:>10.0f} rec/s".format(**result)
+    line += " {mb_per_sec:>8.2f} MB/s {peak_rss_mb:>7.1f} MB".format(**result)
+    if prev:
+        line += "  ({0:+.1f}%)".format(
+            (result["records_per_sec"] / prev["records_per_sec"] - 1) * 100
+        )
+
+    print(line)
+
+
+def compare(results, filename):
+    with open(filename, "rt") as fh:
+        prev_results = json.load(fh)
+
+    print("\ncompared to {0}:".format(prev_results.get("commit")))
+
+    prev = {(res["input"], res["mode"]): res for res in prev_results["results"]}
+    for result in results:
+        print_result(result, prev.get((result["input"], result["mode"])))
+
+
+# ============================================================================
+def main(args=None):
+    parser = ArgumentParser(description="benchmark cdxj-indexer")
+    parser.add_argument("--captures", type=int, default=10000)
+    parser.add_argument("--mix", type=parse_mix)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--payload-size", type=int, default=4096)
+    parser.add_argument("--inputs", default=",".join(INPUTS))
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json")
+    parser.add_argument("--compare")
+
+    cmd = parser.parse_args(args=args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_benchmarks(cmd, tmp_dir)
+
+    report = {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "captures": cmd.captures,
+        "seed": cmd.seed,
+        "payload_size": cmd.payload_size,
+        "results": results,
+    }
+
+    if cmd.json:
+        with open(cmd.json, "wt") as fh:
+            json.dump(report, fh, indent=2)
+
+    if cmd.compare:
+        compare(results, cmd.compare)
+
+
+if __name__ == "__main__":
+    main()
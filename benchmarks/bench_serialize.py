@@ -0,0 +1,66 @@
+"""
+Benchmark CDXJ line serialization: json.dumps() and iso_date_to_timestamp()
+for each line vs. dumps_index() and the cached timestamp conversion.
+
+    python benchmarks/bench_serialize.py [--lines N]
+"""
+
+import json
+import time
+
+from argparse import ArgumentParser
+
+from warcio.timeutils import iso_date_to_timestamp
+
+from cdxj_indexer.main import dumps_index, _cached_timestamp
+
+
+def get_entries(num):
+    entries = []
+    for i in range(num):
+        index = {
+            "url": "https://www.example.com/path/page-{0}.html?id={0}".format(i),
+            "mime": "text/html",
+            "status": "200",
+            "digest": "sha1:ZZJ6SCJCNJ3XSR4GRFW2BKL5KRTXOZ2T",
+            "length": str(1000 + i),
+            "offset": str(i * 1000),
+            "filename": "crawl-{0}.warc.gz".format(i // 10000),
+        }
+        # request and response records of a capture share a WARC-Date
+        date = "2020-10-{0:02}T12:{1:02}:{2:02}Z".format(
+            i // 3600 % 28 + 1, i // 60 % 60, i // 2 % 60
+        )
+        entries.append((index, date))
+
+    return entries
+
+
+def bench(entries, dumps, to_timestamp):
+    start = time.perf_counter()
+    for index, date in entries:
+        "com,example)/ " + to_timestamp(date) + " " + dumps(index) + "\n"
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--lines", type=int, default=1000000)
+    cmd = parser.parse_args()
+
+    entries = get_entries(cmd.lines)
+
+    for index, date in entries:
+        assert dumps_index(index) == json.dumps(index)
+
+    baseline = bench(entries, json.dumps, iso_date_to_timestamp)
+    elapsed = bench(entries, dumps_index, _cached_timestamp)
+
+    print("lines: {0}".format(len(entries)))
+    print("json.dumps:  {0:.3f}s".format(baseline))
+    print("dumps_index: {0:.3f}s  ({1:.1f}x)".format(elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark urlkey computation: surt.surt() for each url vs.
+CDXJIndexer.get_url_key() with the fast path and the urlkey cache.
+
+Urls are taken from the test WARCs, plus synthetic urls for a crawl where
+each url is seen several times (request, response, revisits).
+
+    python benchmarks/bench_urlkey.py [--unique N] [--repeat N]
+"""
+
+import os
+import random
+import time
+
+from argparse import ArgumentParser
+from io import StringIO
+
+import surt
+
+from cdxj_indexer.main import CDXJIndexer
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "test", "data")
+
+
+def get_test_urls():
+    urls = []
+
+    class UrlIndexer(CDXJIndexer):
+        def _do_write(self, urlkey, ts, index, out):
+            if "url" in index:
+                urls.append(index["url"])
+
+    UrlIndexer(StringIO(), [TEST_DIR], records="all", fields="url").process_all()
+    return urls
+
+
+def get_crawl_urls(num_unique, repeat, rng):
+    hosts = ["www.example.com", "cdn.example.net", "img1.example.org", "example.co.uk"]
+    urls = []
+    for i in range(num_unique):
+        host = rng.choice(hosts)
+        path = "/{0}/page-{1}.html".format(rng.choice(["a", "news", "static"]), i)
+        if i % 4 == 0:
+            path += "?id={0}&ref=home".format(i)
+        if i % 7 == 0:
+            path = path.upper()
+
+        urls.append("https://" + host + path)
+
+    urls = urls * repeat
+    rng.shuffle(urls)
+    return urls
+
+
+def time_func(func, urls):
+    start = time.perf_counter()
+    for url in urls:
+        func(url)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--unique", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=4)
+    cmd = parser.parse_args()
+
+    rng = random.Random(0)
+    urls = get_test_urls() * 1000 + get_crawl_urls(cmd.unique, cmd.repeat, rng)
+
+    baseline = time_func(surt.surt, urls)
+    print("urls: {0}".format(len(urls)))
+    print("surt.surt:               {0:.3f}s".format(baseline))
+
+    for name, opts in [
+        ("fast path, no cache", dict(urlkey_cache_size=0)),
+        ("fast path and cache", dict()),
+    ]:
+        indexer = CDXJIndexer(StringIO(), [], **opts)
+        elapsed = time_func(indexer.get_url_key, urls)
+        print(
+            "{0}:     {1:.3f}s  ({2:.1f}x)  {3}".format(
+                name, elapsed, baseline / elapsed, indexer.get_urlkey_stats()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Synthesize WARC and ARC files for benchmarks, with a configurable number
+of captures and mix of capture types. Files are deterministic for a given
+seed, so that results are comparable between commits.
+
+    python benchmarks/synth.py out.warc.gz [--captures N] [--mix get=8,revisit=2]
+"""
+
+import gzip
+import json
+import random
+import uuid
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from pyamf import AMF3
+from pyamf.remoting import Envelope, Request, encode
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+DEFAULT_MIX = {
+    "get": 70,
+    "post-json": 8,
+    "post-form": 6,
+    "post-multipart": 4,
+    "post-amf": 2,
+    "revisit": 10,
+}
+
+START_DATE = datetime(2020, 1, 1)
+
+HOSTS = ["example.com", "www.example.org", "cdn.example.net", "api.example.io"]
+
+
+# ============================================================================
+class Synth:
+    def __init__(self, seed=0, payload_size=4096):
+        self.rng = random.Random(seed)
+        self.payload_size = payload_size
+        self.count = 0
+        self.num_records = 0
+        self.digests = {}
+
+    def next_url(self, num_urls=5000):
+        i = self.rng.randrange(num_urls)
+        host = HOSTS[i % len(HOSTS)]
+        return "http://{0}/path/{1}/page-{2}.html".format(host, i % 17, i)
+
+    def next_date(self):
+        self.count += 1
+        return START_DATE + timedelta(seconds=self.count * 7)
+
+    def record_id(self):
+        return "<urn:uuid:{0}>".format(uuid.UUID(int=self.rng.getrandbits(128)))
+
+    def payload(self, url):
+        size = max(
+            self.rng.randint(self.payload_size // 2, self.payload_size * 3 // 2), 16
+        )
+        text = "<html><body>{0} ".format(url)
+        text += "".join(self.rng.choice("abcdefgh \n") for _ in range(size - len(text)))
+        return text.encode("utf-8")
+
+    def post_body(self, kind):
+        value = self.rng.randrange(1000)
+        if kind == "post-json":
+            data = json.dumps({"id": value, "query": "foo bar", "opts": [1, 2]})
+            return "application/json", data.encode("utf-8")
+
+        elif kind == "post-form":
+            return "application/x-www-form-urlencoded", b"id=%d&q=foo+bar" % value
+
+        elif kind == "post-multipart":
+            boundary = "----boundary{0}".format(value)
+            data = "--{0}\r\n".format(boundary)
+            data += 'Content-Disposition: form-data; name="id"\r\n\r\n'
+            data += "{0}\r\n--{1}--\r\n".format(value, boundary)
+            return "multipart/form-data; boundary=" + boundary, data.encode("utf-8")
+
+        elif kind == "post-amf":
+            env = Envelope(AMF3)
+            env["/0"] = Request(target="t", body=[value])
+            return "application/x-amf", encode(env).getvalue()
+
+    def write_capture(self, writer, kind):
+        url = self.next_url()
+        date = self.next_date().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        method = "GET"
+        body = b""
+        req_headers = [("Host", url.split("/")[2])]
+        if kind.startswith("post-"):
+            method = "POST"
+            content_type, body = self.post_body(kind)
+            req_headers += [
+                ("Content-Type", content_type),
+                ("Content-Length", str(len(body))),
+            ]
+
+        resp_id = self.record_id()
+        warc_headers = {"WARC-Date": date, "WARC-Record-ID": resp_id}
+
+        payload = self.payload(url)
+        http_headers = StatusAndHeaders(
+            "200 OK",
+            [("Content-Type", "text/html"), ("Content-Length", str(len(payload)))],
+            protocol="HTTP/1.1",
+        )
+
+        if kind == "revisit" and url in self.digests:
+            digest, orig_date = self.digests[url]
+            record = writer.create_revisit_record(
+                url,
+                digest,
+                url,
+                orig_date,
+                http_headers=http_headers,
+                warc_headers_dict=warc_headers,
+            )
+        else:
+            record = writer.create_warc_record(
+                url,
+                "response",
+                payload=BytesIO(payload),
+                http_headers=http_headers,
+                warc_headers_dict=warc_headers,
+            )
+
+        writer.write_record(record)
+        self.digests[url] = (record.rec_headers.get_header("WARC-Payload-Digest"), date)
+
+        path = "/" + url.split("/", 3)[3]
+        req = writer.create_warc_record(
+            url,
+            "request",
+            payload=BytesIO(body),
+            http_headers=StatusAndHeaders(
+                method + " " + path + " HTTP/1.1", req_headers, is_http_request=True
+            ),
+            warc_headers_dict={
+                "WARC-Date": date,
+                "WARC-Record-ID": self.record_id(),
+                "WARC-Concurrent-To": resp_id,
+            },
+        )
+        writer.write_record(req)
+        self.num_records += 2
+
+    def write_warc(self, fh, captures, mix=None, gzip=True):
+        writer = WARCWriter(fh, gzip=gzip)
+        kinds, weights = zip(*sorted((mix or DEFAULT_MIX).items()))
+
+        for i in range(captures):
+            self.write_capture(writer, self.rng.choices(kinds, weights)[0])
+
+    def write_arc(self, fh, captures, gzip=True):
+        header = b"1 0 Benchmark\nURL IP-address Archive-date Content-type Archive-length\n\n"
+        self.write_arc_record(fh, "filedesc://bench.arc", "text/plain", header, gzip)
+
+        for i in range(captures):
+            url = self.next_url()
+            payload = self.payload(url)
+            http = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n"
+            http += b"Content-Length: %d\r\n\r\n" % len(payload)
+            self.write_arc_record(fh, url, "text/html", http + payload, gzip)
+
+    def write_arc_record(self, fh, url, mime, body, gzip_):
+        date = self.next_date().strftime("%Y%m%d%H%M%S")
+        line = "{0} 127.0.0.1 {1} {2} {3}\n".format(url, date, mime, len(body))
+        data = line.encode("utf-8") + body + b"\n"
+
+        fh.write(gzip.compress(data) if gzip_ else data)
+        self.num_records += 1
+
+
+def synth_file(path, captures, mix=None, seed=0, payload_size=4096):
+    """Write a synthetic WARC or ARC, depending on extension of path,
+    and return the number of records written"""
+    synth = Synth(seed=seed, payload_size=payload_size)
+    compress = path.endswith(".gz")
+    is_arc = path.endswith((".arc", ".arc.gz")) and ".warc" not in path
+
+    with open(path, "wb") as fh:
+        if is_arc:
+            synth.write_arc(fh, captures, gzip=compress)
+        else:
+            synth.write_warc(fh, captures, mix=mix, gzip=compress)
+
+    return synth.num_records
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise Exception("Unknown capture type: " + name)
+
+        mix[name] = int(weight)
+
+    return mix
+
+
+# ============================================================================
+def main(args=None):
+    parser = ArgumentParser(description="synthesize WARC or ARC files")
+    parser.add_argument("output")
+    parser.add_argument("--captures", type=int, default=10000)
+    parser.add_argument("--mix", type=parse_mix)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--payload-size", type=int, default=4096)
+
+    cmd = parser.parse_args(args=args)
+
+    num = synth_file(cmd.output, cmd.captures, cmd.mix, cmd.seed, cmd.payload_size)
+    print("{0}: {1} records".format(cmd.output, num))
+
+
+if __name__ == "__main__":
+    main()
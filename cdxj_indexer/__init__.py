@@ -1,3 +1,4 @@
 from cdxj_indexer.main import CDXJIndexer, iter_file_or_dir
 from cdxj_indexer.postquery import append_method_query_from_req_resp
 from cdxj_indexer.bufferiter import buffering_record_iter
+from cdxj_indexer.reader import CDXJReader
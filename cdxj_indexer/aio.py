@@ -0,0 +1,165 @@
+import asyncio
+import concurrent.futures
+
+from cdxj_indexer.main import OutputWriter, write_cdx_index
+
+
+# ============================================================================
+class AsyncStreamReader:
+    """Blocking file-like reader, for use in an executor thread, of an async
+    byte stream owned by an event loop. The stream may have an async read(),
+    as aiohttp's StreamReader, or be an async iterable of bytes chunks"""
+
+    CHUNK_SIZE = 1024 * 64
+
+    def __init__(self, stream, loop):
+        self.stream = stream
+        self.loop = loop
+        self.buff = b""
+        self.pos = 0
+        self.cancelled = False
+        self.pending = None
+
+    async def _read(self, size):
+        if hasattr(self.stream, "read"):
+            return await self.stream.read(size)
+
+        while not self.buff:
+            try:
+                self.buff = await self.stream.__anext__()
+            except StopAsyncIteration:
+                return b""
+
+        if size is None or size < 0:
+            size = len(self.buff)
+
+        buff = self.buff[:size]
+        self.buff = self.buff[size:]
+        return buff
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            buffs = []
+            while True:
+                buff = self.read(self.CHUNK_SIZE)
+                if not buff:
+                    return b"".join(buffs)
+
+                buffs.append(buff)
+
+        if self.cancelled:
+            raise Exception("Indexing cancelled")
+
+        self.pending = asyncio.run_coroutine_threadsafe(self._read(size), self.loop)
+        try:
+            buff = self.pending.result()
+        except concurrent.futures.CancelledError:
+            raise Exception("Indexing cancelled")
+        finally:
+            self.pending = None
+
+        self.pos += len(buff)
+        return buff
+
+    def tell(self):
+        return self.pos
+
+    def cancel(self):
+        self.cancelled = True
+        pending = self.pending
+        if pending:
+            pending.cancel()
+
+
+# ============================================================================
+class AsyncLinesWriter(OutputWriter):
+    """Output for an indexer in an executor thread, passing lists of index
+    lines to an asyncio.Queue. Blocks while the queue is full"""
+
+    WRITE_BUFF_SIZE = 1024 * 16
+
+    def __init__(self, queue, loop):
+        super().__init__(None)
+        self.queue = queue
+        self.loop = loop
+        self.cancelled = False
+
+    def write_buff(self):
+        if self.cancelled:
+            raise Exception("Indexing cancelled")
+
+        lines = b"".join(self.buff).decode("utf-8").split("\n")
+        if not lines[-1]:
+            lines.pop()
+
+        self.buff = []
+        self.size = 0
+        self.put(lines)
+
+    def put(self, item):
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+    def flush(self):
+        if self.buff:
+            self.write_buff()
+
+
+# ============================================================================
+async def index_stream(stream, filename, opts=None, executor=None, queue_size=16):
+    """Index an async byte stream of a WARC or ARC file, yielding index lines
+    as str, without trailing newline.
+
+    Indexing runs in executor, or the loop's default executor, reading the
+    stream from the event loop as needed, so that several streams may be
+    indexed concurrently. Lines are passed from the executor in batches of
+    about 16KB. opts are as for write_cdx_index(), and filename is the
+    filename stored in the index.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+
+    reader = AsyncStreamReader(stream, loop)
+    writer = AsyncLinesWriter(queue, loop)
+
+    opts = dict(opts or {})
+    opts["filename"] = filename
+
+    def run():
+        try:
+            write_cdx_index(writer, reader, opts)
+        finally:
+            writer.put(None)
+
+    future = loop.run_in_executor(executor, run)
+
+    try:
+        while True:
+            lines = await queue.get()
+            if lines is None:
+                break
+
+            for line in lines:
+                yield line
+
+        await future
+
+    finally:
+        # if not fully consumed, stop indexing and wait for the thread
+        if not future.done():
+            reader.cancel()
+            writer.cancelled = True
+
+            while not future.done():
+                while not queue.empty():
+                    queue.get_nowait()
+
+                await asyncio.wait([future], timeout=0.05)
+
+            future.exception()
+
+
+async def write_cdx_index_async(output, inputs, opts, executor=None):
+    """Run write_cdx_index() for files in executor, or the loop's default
+    executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, write_cdx_index, output, inputs, opts)
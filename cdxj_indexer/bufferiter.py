@@ -10,23 +10,34 @@ BUFF_SIZE = 1024 * 64
 
 # ============================================================================
 def buffering_record_iter(
-    record_iter, post_append=False, digest_reader=None, url_key_func=None
+    record_iter,
+    post_append=False,
+    digest_reader=None,
+    url_key_func=None,
+    lazy=False,
+    stats=None,
+    mmap_reader=None,
 ):
     prev_record = None
 
+    buffer_content = buffer_record_content
+    if stats:
+        buffer_content = stats.timed("buffer", buffer_record_content)
+
     for record in record_iter:
-        buffer_record_content(record)
+        if digest_reader:
+            digest_reader.begin_record(record_iter.offset)
+
+        if not lazy or is_query_request(record, post_append):
+            buffer_content(record, record_iter, mmap_reader)
+        else:
+            record.buffered_stream = None
 
         record.file_offset = record_iter.get_record_offset()
         record.file_length = record_iter.get_record_length()
 
         if digest_reader:
-            curr = digest_reader.tell()
-            digest_reader.seek(record.file_offset)
-            record_digest, digest_length = digest_block(
-                digest_reader, record.file_length
-            )
-            digest_reader.seek(curr)
+            record_digest, digest_length = digest_reader.end_record(record.file_length)
 
             if digest_length != record.file_length:
                 raise Exception(
@@ -43,21 +54,21 @@ def buffering_record_iter(
         if not req or not resp:
             if prev_record:
                 yield prev_record
-                prev_record.buffered_stream.close()
+                close_buffer(prev_record)
             prev_record = record
             continue
 
         join_req_resp(req, resp, post_append, url_key_func)
 
         yield prev_record
-        prev_record.buffered_stream.close()
+        close_buffer(prev_record)
         yield record
-        record.buffered_stream.close()
+        close_buffer(record)
         prev_record = None
 
     if prev_record:
         yield prev_record
-        prev_record.buffered_stream.close()
+        close_buffer(prev_record)
 
 
 # ============================================================================
@@ -90,13 +101,33 @@ def concur_req_resp(rec_1, rec_2):
 
 
 # ============================================================================
-def buffer_record_content(record):
+def buffer_record_content(record, record_iter=None, mmap_reader=None):
+    if mmap_reader:
+        record.buffered_stream = mmap_reader.open_payload(record_iter, record)
+        if record.buffered_stream:
+            return
+
     spool = tempfile.SpooledTemporaryFile(BUFF_SIZE)
     shutil.copyfileobj(record.content_stream(), spool)
     spool.seek(0)
     record.buffered_stream = spool
 
 
+def close_buffer(record):
+    if record.buffered_stream:
+        record.buffered_stream.close()
+
+
+# ============================================================================
+def is_query_request(record, post_append):
+    """Return true if the record is a request with a body that
+    will be read to append a POST/PUT query"""
+    if not post_append or record.rec_type != "request" or not record.http_headers:
+        return False
+
+    return record.http_headers.protocol.upper() in ("POST", "PUT")
+
+
 # ============================================================================
 def join_req_resp(req, resp, post_append, url_key_func=None):
     if req.http_headers is None:
@@ -116,6 +147,78 @@ def join_req_resp(req, resp, post_append, url_key_func=None):
         req.urlkey = resp.urlkey
 
 
+# ============================================================================
+class DigestingReader:
+    """Pass-through reader which computes the sha256 digest of the raw bytes
+    of each record as they are read by the archive iterator, so that record
+    digests do not require reading the input twice or seeking.
+
+    As the iterator reads ahead of the current record, hashing lags the read
+    position by `window` bytes, until the record length is known.
+    """
+
+    def __init__(self, fh, window=BUFF_SIZE):
+        self.fh = fh
+        self.window = window
+
+        try:
+            self.pos = fh.tell()
+        except Exception:
+            self.pos = 0
+
+        self.buff = bytearray()
+        self.buff_start = self.pos
+
+        self.hasher = None
+        self.record_start = None
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.pos += len(data)
+        self.buff += data
+
+        if self.hasher:
+            self._update(self.pos - self.window)
+
+        return data
+
+    def tell(self):
+        return self.pos
+
+    def begin_record(self, offset):
+        if offset < self.buff_start:
+            raise Exception(
+                "Digest start mismatch, expected {0}, got {1}".format(
+                    self.buff_start, offset
+                )
+            )
+
+        del self.buff[: offset - self.buff_start]
+        self.buff_start = offset
+
+        self.hasher = hashlib.sha256()
+        self.record_start = offset
+
+    def end_record(self, length):
+        self._update(min(self.record_start + length, self.pos))
+
+        count = self.buff_start - self.record_start
+        digest = "sha256:" + self.hasher.hexdigest()
+        self.hasher = None
+        return digest, count
+
+    def _update(self, end):
+        size = end - self.buff_start
+        if size <= 0:
+            return
+
+        with memoryview(self.buff) as view:
+            self.hasher.update(view[:size])
+
+        del self.buff[:size]
+        self.buff_start = end
+
+
 # ============================================================================
 def digest_block(reader, length):
     count = 0
@@ -0,0 +1,74 @@
+import zlib
+
+try:
+    from isal import isal_zlib
+except ImportError:  # pragma: no cover
+    isal_zlib = None
+
+try:
+    from zlib_ng import zlib_ng
+except ImportError:  # pragma: no cover
+    zlib_ng = None
+
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# zlib compatible modules, fastest first
+CODECS = {
+    "isal": isal_zlib,
+    "zlib-ng": zlib_ng,
+    "zlib": zlib,
+}
+
+
+# ============================================================================
+def get_codec(name=None):
+    """Return the zlib compatible module for gzip codec name, or the fastest
+    one installed if name is None or "auto". Codecs differ in compressed
+    output, but all write standard gzip members
+
+    >>> get_codec("zlib") is zlib
+    True
+    >>> get_codec() is not None
+    True
+    """
+    if not name or name == "auto":
+        return next(codec for codec in CODECS.values() if codec)
+
+    if name not in CODECS:
+        raise Exception("Unknown gzip codec: " + name)
+
+    if not CODECS[name]:
+        raise Exception("gzip codec not installed: " + name)
+
+    return CODECS[name]
+
+
+def get_codec_names():
+    """Return names of the installed gzip codecs"""
+    return [name for name, codec in CODECS.items() if codec]
+
+
+def gzip_compress(data, codec=zlib):
+    """Compress data as a single gzip member"""
+    comp = codec.compressobj(wbits=GZIP_WBITS)
+    return comp.compress(data) + comp.flush()
+
+
+def set_reader_codec(reader, codec):
+    """Decompress gzip members read by a warcio BufferedReader with codec,
+    unless the reader does not have the expected decompressor state"""
+    if codec is zlib:
+        return
+
+    if not all(
+        hasattr(reader, name) for name in ("DECOMPRESSORS", "decomp_type", "set_decomp")
+    ):
+        return
+
+    def gzip_decompressor():
+        return codec.decompressobj(GZIP_WBITS)
+
+    reader.DECOMPRESSORS = dict(reader.DECOMPRESSORS, gzip=gzip_decompressor)
+    if reader.decomp_type:
+        reader.set_decomp(reader.decomp_type)
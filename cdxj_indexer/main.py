@@ -6,12 +6,17 @@ import os
 import re
 import sys
 import zlib
+import gzip
 import hashlib
 import heapq
 
 from argparse import ArgumentParser, RawTextHelpFormatter
-from io import BytesIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO, TextIOBase
 from copy import copy
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
 from tempfile import NamedTemporaryFile
 
 
@@ -21,7 +26,20 @@ from warcio.warcwriter import BufferWARCWriter
 from warcio.archiveiterator import ArchiveIterator
 from warcio.utils import open_or_default
 
-from cdxj_indexer.bufferiter import buffering_record_iter, BUFF_SIZE
+from cdxj_indexer.bufferiter import (
+    buffering_record_iter,
+    DigestingReader,
+    BUFF_SIZE,
+)
+from cdxj_indexer.splitter import RangeReader, split_gzip_members
+from cdxj_indexer.manifest import IndexManifest
+from cdxj_indexer.urlkey import fast_surt
+from cdxj_indexer.stats import IndexStats, get_pos
+from cdxj_indexer.progress import ProgressReporter, print_progress, get_size
+from cdxj_indexer.skipiter import SkippingArchiveIterator
+from cdxj_indexer.mmapreader import open_mmap
+from cdxj_indexer.codec import CODECS, get_codec, gzip_compress, set_reader_codec
+from cdxj_indexer.revisits import DigestMap
 
 
 # ============================================================================
@@ -49,12 +67,39 @@ class CDXJIndexer(Indexer):
 
     DEFAULT_RECORDS = ["response", "revisit", "resource", "metadata"]
 
+    ORIG_FIELDS = (
+        "orig.url",
+        "orig.timestamp",
+        "orig.filename",
+        "orig.offset",
+        "orig.length",
+    )
+
     ALLOWED_EXT = (".arc", ".arc.gz", ".warc", ".warc.gz")
 
     RE_SPACE = re.compile(r"[;\s]")
 
+    RE_FILENAME_FIELD = re.compile(rb'"filename": "[^"\\]*(?:\\.[^"\\]*)*"')
+
     DEFAULT_NUM_LINES = 300
 
+    DEFAULT_SPLIT_SIZE = 1024 * 1024 * 256
+
+    DEFAULT_URLKEY_CACHE_SIZE = 1024 * 64
+
+    # options which don't change the index lines of a file
+    CACHE_IGNORED_OPTS = (
+        "lazy_buffer",
+        "mmap_input",
+        "skip_payload",
+        "gzip_codec",
+        "urlkey_cache_size",
+        "max_sort_buff_size",
+        "sort_tmp_dir",
+        "sort_compress_runs",
+        "sort_max_scratch",
+    )
+
     def __init__(
         self,
         output,
@@ -72,6 +117,30 @@ class CDXJIndexer(Indexer):
         verify_http=False,
         dir_root=None,
         digest_records=False,
+        workers=None,
+        split_size=None,
+        lazy_buffer=False,
+        sort_tmp_dir=None,
+        sort_compress_runs=False,
+        sort_max_scratch=None,
+        compress_threads=None,
+        cache_dir=None,
+        cache_hash=False,
+        urlkey_cache_size=DEFAULT_URLKEY_CACHE_SIZE,
+        block_bytes=None,
+        block_bytes_compressed=False,
+        stats=False,
+        stats_output=None,
+        progress=False,
+        progress_callback=None,
+        progress_interval=None,
+        skip_payload=True,
+        mmap_input=True,
+        gzip_codec=None,
+        dedup=False,
+        dedup_max_keys=None,
+        resolve_revisits=False,
+        revisit_map_size=None,
         **kwargs
     ):
 
@@ -80,6 +149,27 @@ class CDXJIndexer(Indexer):
 
         inputs = iter_file_or_dir(inputs)
 
+        # options needed to re-create an equivalent indexer in a worker process
+        self.index_opts = dict(
+            post_append=post_append,
+            max_sort_buff_size=max_sort_buff_size,
+            filename=filename,
+            fields=fields,
+            replace_fields=replace_fields,
+            records=records,
+            verify_http=verify_http,
+            dir_root=dir_root,
+            digest_records=digest_records,
+            lazy_buffer=lazy_buffer,
+            sort_tmp_dir=sort_tmp_dir,
+            sort_compress_runs=sort_compress_runs,
+            sort_max_scratch=sort_max_scratch,
+            urlkey_cache_size=urlkey_cache_size,
+            skip_payload=skip_payload,
+            mmap_input=mmap_input,
+            gzip_codec=gzip_codec,
+        )
+
         self.digest_records = digest_records
         fields = self._parse_fields(fields, replace_fields)
 
@@ -92,12 +182,67 @@ class CDXJIndexer(Indexer):
         self.force_filename = filename
         self.post_append = post_append
         self.dir_root = dir_root
+        self.lazy_buffer = lazy_buffer
+        self.skip_payload = skip_payload
+        self.mmap_input = mmap_input
+        # gzipped inputs are read with the fastest installed codec by default,
+        # which decompresses to the same data. Compressed output is only
+        # changed by choosing a codec
+        self.codec = get_codec(gzip_codec)
+        self.compress_codec = get_codec(gzip_codec or "zlib")
 
         self.num_lines = lines
         self.max_sort_buff_size = max_sort_buff_size
+        self.sort_tmp_dir = sort_tmp_dir
+        self.sort_compress_runs = sort_compress_runs
+        self.sort_max_scratch = sort_max_scratch
         self.sort = sort
         self.compress = compress
         self.data_out_name = data_out_name
+        self.compress_threads = compress_threads
+        self.dedup = dedup
+        self.dedup_max_keys = dedup_max_keys
+        self.block_bytes = block_bytes
+        self.block_bytes_compressed = block_bytes_compressed
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.cache_hash = cache_hash
+
+        # urlkeys repeat across revisits and request/response pairs,
+        # keep a bounded cache of recent urlkeys
+        self.urlkey_fast_count = 0
+        self._cached_url_key = None
+        if urlkey_cache_size:
+            self._cached_url_key = lru_cache(maxsize=urlkey_cache_size)(
+                self._compute_url_key
+            )
+        self.split_size = split_size or self.DEFAULT_SPLIT_SIZE
+
+        # if set, revisits are annotated with the location of the original
+        # capture with the same payload digest, if indexed before them
+        self.revisit_map = None
+        if resolve_revisits:
+            self.revisit_map = DigestMap(revisit_map_size, sort_tmp_dir)
+
+        # if set, time indexing stages, and write stats at the end of
+        # process_all(), to stderr or to stats_output
+        self.stats = None
+        self.stats_output = stats_output
+        if stats or stats_output:
+            self.stats = IndexStats()
+            self.process_index_entry = self.stats.timed(
+                "index", self.process_index_entry
+            )
+            self.get_url_key = self.stats.timed("urlkey", self.get_url_key)
+            self._do_write = self.stats.timed("serialize", self._do_write)
+
+        # if set, progress events are passed to progress_callback,
+        # or printed to stderr
+        self.progress = None
+        if progress or progress_callback:
+            self.progress = ProgressReporter(
+                progress_callback or print_progress, progress_interval
+            )
 
         self.include_records = records
         if self.include_records == "all":
@@ -182,8 +327,18 @@ class CDXJIndexer(Indexer):
 
     def process_all(self):
         data_out = None
+        compressed = None
+
+        if self.stats:
+            self.stats.begin()
+
+        if self.progress:
+            self.inputs = list(self.inputs)
+            self.progress.begin(self.inputs)
+
+        with open_or_default(self.output, "wb", get_stdout()) as fh:
+            fh = wrap_output(fh)
 
-        with open_or_default(self.output, "wt", sys.stdout) as fh:
             if self.compress:
                 if isinstance(self.compress, str):
                     data_out = open(self.compress, "wb")
@@ -196,6 +351,10 @@ class CDXJIndexer(Indexer):
                         data_out_name=self.compress,
                         num_lines=self.num_lines,
                         digest_records=self.digest_records,
+                        threads=self.compress_threads,
+                        codec=self.compress_codec,
+                        block_bytes=self.block_bytes,
+                        block_bytes_compressed=self.block_bytes_compressed,
                     )
                 else:
                     fh = CompressedWriter(
@@ -204,19 +363,221 @@ class CDXJIndexer(Indexer):
                         data_out_name=self.data_out_name,
                         num_lines=self.num_lines,
                         digest_records=self.digest_records,
+                        threads=self.compress_threads,
+                        codec=self.compress_codec,
+                        block_bytes=self.block_bytes,
+                        block_bytes_compressed=self.block_bytes_compressed,
                     )
 
+                compressed = fh
+
+            # writers are stacked Sorting -> Dedup -> Compressed, so that
+            # with sorting, duplicates are dropped from the sorted, merged
+            # lines, where they are adjacent
+            dedup = None
+            if self.dedup:
+                fh = dedup = DedupWriter(fh, self.get_dedup_key, self.dedup_max_keys)
+
             if self.sort:
-                fh = SortingWriter(fh, self.max_sort_buff_size)
+                fh = SortingWriter(
+                    fh,
+                    self.max_sort_buff_size,
+                    compress_runs=self.sort_compress_runs,
+                    tmp_dir=self.sort_tmp_dir,
+                    max_scratch_size=self.sort_max_scratch,
+                )
+
+            if self.stats:
+                self._add_writer_stats(fh, compressed)
 
             self.output = fh
 
+            # originals of revisits must be indexed by this process
+            parallel = (self.workers and self.workers > 1) or self.cache_dir
+            try:
+                if parallel and self.revisit_map is None:
+                    self.process_all_runs(fh)
+                else:
+                    super().process_all()
+            finally:
+                if self.revisit_map:
+                    self.revisit_map.close()
+
+            fh.flush()
+            if data_out:
+                data_out.close()
+
+        if self.progress:
+            self.progress.end()
+
+        if self.stats:
+            self.stats.end()
+            if self.sort:
+                self.stats.counts["spills"] = fh.num_spills
+            if compressed:
+                self.stats.counts["compressed_bytes"] = compressed.offset
+            if dedup:
+                self.stats.counts["duplicates"] = dedup.num_dropped
+
+            self.stats.write(self.stats_output)
+
+    def _add_writer_stats(self, fh, compressed):
+        self.stats.wrap_writer(fh)
+        if self.sort:
+            fh.flush = self.stats.timed("sort", fh.flush)
+
+        if compressed:
+            compressed.flush_block = self.stats.timed(
+                "compress", compressed.flush_block
+            )
+            compressed.write_pending = self.stats.timed(
+                "compress", compressed.write_pending
+            )
+
+    def process_all_runs(self, out):
+        inputs = list(self.inputs)
+
+        # file objects can't be shared with worker processes, or cached,
+        # index serially
+        if not all(isinstance(input_, str) and input_ != "-" for input_ in inputs):
+            self.inputs = inputs
             super().process_all()
+            return
+
+        manifest = None
+        run_dir = None
+        if self.cache_dir:
+            manifest = IndexManifest(
+                self.cache_dir, self.get_cache_key(), self.cache_hash
+            )
+            run_dir = self.cache_dir
+
+        # (input, file info, cached runs, or ids of tasks to create runs)
+        jobs = []
+        tasks = []
+        for input_ in inputs:
+            runs, info = manifest.check(input_) if manifest else (None, None)
+            if runs is not None:
+                jobs.append((input_, info, runs, None))
+            else:
+                new_tasks = self._get_worker_tasks(input_, run_dir)
+                task_ids = range(len(tasks), len(tasks) + len(new_tasks))
+                jobs.append((input_, info, None, task_ids))
+                tasks.extend(new_tasks)
+
+        # runs created so far, by task id
+        finished = {}
+
+        executor = None
+        if self.workers and self.workers > 1:
+            executor = ProcessPoolExecutor(self.workers)
+            futures = [executor.submit(_index_to_run, task) for task in tasks]
+
+        def get_run(task_id):
+            if executor:
+                finished[task_id] = futures[task_id].result()
+            else:
+                finished[task_id] = _index_to_run(tasks[task_id])
+
+            return finished[task_id]
 
-            if self.sort or self.compress:
-                fh.flush()
-                if data_out:
-                    data_out.close()
+        num_done = 0
+        try:
+            for input_, info, runs, task_ids in jobs:
+                if runs is None:
+                    runs = [get_run(task_id) for task_id in task_ids]
+                    if manifest:
+                        manifest.update(input_, info, runs)
+
+                num_done += 1
+
+                for run_name in runs:
+                    self._add_run(out, run_name, keep=manifest is not None)
+
+                if self.progress:
+                    self.progress.file_done(get_size(input_))
+
+        except BaseException:
+            # don't index remaining inputs, but wait for running tasks
+            # to finish, so that their runs can be removed
+            if executor:
+                for future in futures:
+                    future.cancel()
+
+                executor.shutdown()
+                executor = None
+
+                for task_id, future in enumerate(futures):
+                    if not future.cancelled() and not future.exception():
+                        finished[task_id] = future.result()
+
+            self._discard_runs(jobs[num_done:], finished, manifest)
+            raise
+
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if manifest:
+            manifest.prune()
+            manifest.save()
+
+    def _discard_runs(self, jobs, finished, manifest):
+        """Remove runs which were created but not added to the output after
+        an error. With a cache dir, runs of fully indexed inputs are cached"""
+        keep = set()
+        if manifest:
+            for input_, info, runs, task_ids in jobs:
+                if runs is None and all(task_id in finished for task_id in task_ids):
+                    manifest.update(input_, info, [finished[i] for i in task_ids])
+
+            for entry in manifest.entries.values():
+                keep.update(entry["runs"])
+
+            manifest.save()
+
+        for run_name in finished.values():
+            if os.path.basename(run_name) not in keep and os.path.isfile(run_name):
+                os.remove(run_name)
+
+    def _add_run(self, out, run_name, keep=False):
+        if self.sort:
+            out.add_run(run_name, keep=keep)
+            return
+
+        with open(run_name, "rb") as run:
+            for line in run:
+                out.write(line)
+
+        if not keep:
+            os.remove(run_name)
+
+    def get_cache_key(self):
+        """Return a key for the options which affect per-file runs"""
+        opts = dict(self.index_opts)
+        for name in self.CACHE_IGNORED_OPTS:
+            opts.pop(name, None)
+
+        opts["sort"] = bool(self.sort)
+        opts["indexer"] = self.__class__.__module__ + "." + self.__class__.__name__
+        return json.dumps(opts, sort_keys=True)
+
+    def _get_worker_tasks(self, input_, run_dir=None):
+        if (
+            not input_.endswith(".warc.gz")
+            or os.path.getsize(input_) <= self.split_size
+        ):
+            return [(self.__class__, self.index_opts, input_, self.sort, None, run_dir)]
+
+        # index large files in parallel by ranges of gzip members,
+        # resolving the filename here as each range is read as a file object
+        opts = dict(self.index_opts)
+        opts["filename"] = self.force_filename or self._resolve_rel_path(input_)
+
+        return [
+            (self.__class__, opts, input_, self.sort, byte_range, run_dir)
+            for byte_range in split_gzip_members(input_, self.split_size)
+        ]
 
     def _resolve_rel_path(self, filename):
         if not self.dir_root:
@@ -228,26 +589,83 @@ class CDXJIndexer(Indexer):
         return path
 
     def process_one(self, input_, output, filename):
+        # only write header once per file if indexing a range of the file
+        if not isinstance(input_, RangeReader) or not input_.start:
+            self._write_header(output, filename)
+
+        for it, record in self.iter_index_records(input_, filename):
+            self.process_index_entry(it, record, filename, output)
+
+    def iter_index_records(self, input_, filename):
+        """Yield (record iterator, record) for each record of input_
+        to be indexed"""
         self.curr_filename = self.force_filename or self._resolve_rel_path(filename)
 
-        it = self._create_record_iter(input_)
+        start_pos = get_pos(input_) if self.stats else None
 
-        self._write_header(output, filename)
+        mmap_reader = None
+        if self.mmap_input:
+            mmap_reader = open_mmap(input_)
+            if mmap_reader:
+                input_ = mmap_reader
+
+        digest_reader = None
+        if self.collect_records and self.digest_records:
+            if mmap_reader:
+                digest_reader = mmap_reader
+            else:
+                input_ = digest_reader = DigestingReader(input_)
+
+        it = self._create_record_iter(input_)
 
         if self.collect_records:
-            digest_reader = input_ if self.digest_records else None
             wrap_it = buffering_record_iter(
                 it,
                 post_append=self.post_append,
                 digest_reader=digest_reader,
                 url_key_func=self.get_url_key,
+                lazy=self.lazy_buffer,
+                stats=self.stats,
+                mmap_reader=mmap_reader,
             )
         else:
             wrap_it = it
 
-        for record in wrap_it:
-            if not self.include_records or self.filter_record(record):
-                self.process_index_entry(it, record, filename, output)
+        if self.stats:
+            wrap_it = self.stats.iter_records(wrap_it)
+
+        if self.progress:
+            wrap_it = self.progress.iter_records(wrap_it, input_)
+
+        try:
+            for record in wrap_it:
+                if not self.include_records or self.filter_record(record):
+                    yield it, record
+
+        finally:
+            if mmap_reader:
+                mmap_reader.close()
+
+        if self.stats:
+            self.stats.add_input(start_pos, get_pos(input_))
+
+        if self.progress:
+            self.progress.file_done()
+
+    def _create_record_iter(self, input_):
+        if self.skip_payload:
+            # skip unread payloads, if no field needs them
+            it = SkippingArchiveIterator(
+                input_,
+                no_record_parse=not self.record_parse,
+                arc2warc=True,
+                verify_http=self.verify_http,
+            )
+        else:
+            it = super()._create_record_iter(input_)
+
+        set_reader_codec(it.reader, self.codec)
+        return it
 
     def filter_record(self, record):
         if not record.rec_type in self.include_records:
@@ -281,7 +699,7 @@ class CDXJIndexer(Indexer):
 
         dt = record.rec_headers.get("WARC-Date")
 
-        ts = iso_date_to_timestamp(dt)
+        ts = _cached_timestamp(dt)
 
         if hasattr(record, "urlkey"):
             urlkey = record.urlkey
@@ -293,29 +711,151 @@ class CDXJIndexer(Indexer):
         if hasattr(record, "method"):
             index["method"] = record.method
 
-        self._do_write(urlkey, ts, index, out)
+        if self.revisit_map:
+            self._resolve_revisit(record, index, url, ts)
+
+        if isinstance(out, EntryList):
+            out.append((urlkey, ts, index))
+        else:
+            self._do_write(urlkey, ts, index, out)
+
+    def _resolve_revisit(self, record, index, url, ts):
+        digest = index.get("digest")
+        if not digest:
+            return
+
+        if record.rec_type in ("response", "resource"):
+            orig = (url, ts) + tuple(
+                index.get(name) for name in ("filename", "offset", "length")
+            )
+            self.revisit_map.add(digest, orig)
+
+        # digest computed for a revisit without a digest is of an empty payload
+        elif record.rec_type == "revisit" and record.rec_headers.get_header(
+            "WARC-Payload-Digest"
+        ):
+            orig = self.revisit_map.get(digest)
+            if orig:
+                for name, value in zip(self.ORIG_FIELDS, orig):
+                    if value is not None:
+                        index[name] = value
+
+    def iter_entries(self, sort=None, dedup=False):
+        """Yield (urlkey, timestamp, index dict) for each index entry of
+        the inputs, as they are read, without serializing them.
+
+        If sort is set, or if sort was set for the indexer, all entries
+        are read and sorted in memory, in the same order as sorted output.
+        If dedup is set, duplicate adjacent entries are dropped.
+        """
+        if sort is None:
+            sort = self.sort
+
+        entries = self._iter_all_entries()
+
+        if sort:
+            entries = sorted(
+                entries, key=lambda entry: (entry[0], entry[1], dumps_index(entry[2]))
+            )
+
+        if not dedup:
+            yield from entries
+            return
+
+        last = None
+        for entry in entries:
+            if entry != last:
+                yield entry
+            last = entry
+
+    def _iter_all_entries(self):
+        if self.progress:
+            self.inputs = list(self.inputs)
+            self.progress.begin(self.inputs)
+
+        entries = EntryList()
+
+        try:
+            for filename in self.inputs:
+                with open_or_default(filename, "rb", get_stdin()) as fh:
+                    for it, record in self.iter_index_records(fh, filename):
+                        self.process_index_entry(it, record, filename, entries)
+                        yield from entries
+                        entries.clear()
+        finally:
+            if self.revisit_map:
+                self.revisit_map.close()
+
+        if self.progress:
+            self.progress.end()
 
     def _do_write(self, urlkey, ts, index, out):
-        out.write(urlkey + " " + ts + " " + json.dumps(index) + "\n")
+        line = urlkey + " " + ts + " " + dumps_index(index) + "\n"
+        out.write(line.encode("utf-8"))
+
+    def get_dedup_key(self, line):
+        """Return index line without the filename, to find captures
+        indexed from copies of the same file"""
+        return self.RE_FILENAME_FIELD.sub(b"", line, 1)
 
     def get_url_key(self, url):
+        if self._cached_url_key:
+            return self._cached_url_key(url)
+
+        return self._compute_url_key(url)
+
+    def _compute_url_key(self, url):
+        urlkey = fast_surt(url)
+        if urlkey:
+            self.urlkey_fast_count += 1
+            return urlkey
+
         try:
             return surt.surt(url)
         except:  # pragma: no coverage
             return url
 
+    def get_urlkey_stats(self):
+        """Return urlkey cache hits and misses, and the number of
+        urlkeys computed by the fast path"""
+        stats = {"hits": 0, "misses": 0, "fast": self.urlkey_fast_count}
+        if self._cached_url_key:
+            info = self._cached_url_key.cache_info()
+            stats["hits"] = info.hits
+            stats["misses"] = info.misses
+
+        return stats
+
+
+# ============================================================================
+class EntryList(list):
+    """Output collecting index entries as (urlkey, timestamp, index) tuples"""
+
 
 # ============================================================================
 class CDXLegacyIndexer(CDXJIndexer):
+    def __init__(self, *args, **kwargs):
+        # CDX_FIELDS have no orig.* columns
+        if kwargs.get("resolve_revisits"):
+            raise ValueError("Resolving revisits is only supported for CDXJ output")
+
+        super().__init__(*args, **kwargs)
+
     def _do_write(self, urlkey, ts, index, out):
         index["urlkey"] = urlkey
         index["timestamp"] = ts
 
         line = " ".join(index.get(field, "-") for field in self.CDX_FIELDS)
-        out.write(line + "\n")
+        out.write((line + "\n").encode("utf-8"))
 
     def _write_header(self, out, filename):
-        out.write(self.CDX_HEADER + "\n")
+        out.write((self.CDX_HEADER + "\n").encode("utf-8"))
+
+    def get_dedup_key(self, line):
+        if line.startswith(b" CDX "):
+            return None
+
+        return line.rsplit(b" ", 1)[0]
 
     def get_field(self, record, name, it, filename):
         value = super().get_field(record, name, it, filename)
@@ -366,59 +906,331 @@ class CDX09Indexer(CDXLegacyIndexer):
 class SortingWriter:
     MAX_SORT_BUFF_SIZE = 1024 * 1024 * 32
 
-    def __init__(self, out, max_sort_buff_size=None):
-        self.out = out
+    MAX_MERGE_FAN_IN = 64
+
+    COMPRESSED_RUN_EXT = ".cdxj.gz"
+
+    def __init__(
+        self,
+        out,
+        max_sort_buff_size=None,
+        max_fan_in=None,
+        compress_runs=False,
+        tmp_dir=None,
+        max_scratch_size=None,
+        dedup=True,
+    ):
+        self.out = wrap_output(out)
         self.sortedlist = []
         self.count = 0
         self.max_sort_buff_size = max_sort_buff_size or self.MAX_SORT_BUFF_SIZE
+        self.max_fan_in = max(max_fan_in or self.MAX_MERGE_FAN_IN, 2)
+
+        self.compress_runs = compress_runs
+        self.tmp_dir = tmp_dir
+        self.max_scratch_size = max_scratch_size
+        self.scratch_size = 0
+
+        # drop duplicate adjacent lines
+        self.dedup = dedup
 
         self.tmp_files = []
+        self.keep_files = set()
+        self.num_spills = 0
+
+        # runs are sorted and written by a background thread, overlapping
+        # with indexing. At most one run is pending, bounding memory use
+        self.executor = None
+        self.pending = None
 
     def write(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+
         self.sortedlist.append(line)
         self.count += len(line)
 
         if self.count > self.max_sort_buff_size:
-            self.tmp_files.append(self.write_to_temp())
-            self.sortedlist = []
-            self.count = 0
+            self.spill()
+
+    def spill(self):
+        self.wait_pending()
+
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(1)
+
+        self.pending = self.executor.submit(self.write_to_temp, self.sortedlist)
+        self.num_spills += 1
+        self.sortedlist = []
+        self.count = 0
+
+    def wait_pending(self):
+        if self.pending:
+            self.add_temp(self.pending.result())
+            self.pending = None
+
+    def add_temp(self, name):
+        self.tmp_files.append(name)
+        self.scratch_size += os.path.getsize(name)
+
+        if self.max_scratch_size and self.scratch_size > self.max_scratch_size:
+            self.cleanup()
+            raise Exception(
+                "Sort temp files exceed max scratch size of {0} bytes".format(
+                    self.max_scratch_size
+                )
+            )
+
+    def cleanup(self):
+        for name in self.tmp_files:
+            if name not in self.keep_files and os.path.isfile(name):
+                os.remove(name)
+
+        self.tmp_files = []
+        self.scratch_size = 0
 
     def flush(self):
+        self.wait_pending()
+
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
         if not len(self.tmp_files):
             self.sortedlist.sort()
             self.write_to_file(self.sortedlist, self.out)
             return
 
         if len(self.sortedlist) > 0:
-            self.tmp_files.append(self.write_to_temp())
+            self.add_temp(self.write_to_temp(self.sortedlist))
+            self.num_spills += 1
             self.sortedlist = []
             self.count = 0
 
-        open_files = [open(name, "rt", encoding="utf-8") for name in self.tmp_files]
+        # cascade merge runs until at most max_fan_in remain. tmp_files
+        # lists all runs on disk, merged or not, to be removed on error
+        while len(self.tmp_files) > self.max_fan_in:
+            groups = [
+                self.tmp_files[i : i + self.max_fan_in]
+                for i in range(0, len(self.tmp_files), self.max_fan_in)
+            ]
+
+            for group in groups:
+                if len(group) == 1:
+                    continue
+
+                size = sum(
+                    os.path.getsize(name)
+                    for name in group
+                    if name not in self.keep_files
+                )
+                try:
+                    with self.open_temp("wb") as out:
+                        self.tmp_files.append(out.name)
+                        self.merge_runs(group, out)
+                except BaseException:
+                    self.cleanup()
+                    raise
+
+                for name in group + [out.name]:
+                    self.tmp_files.remove(name)
+
+                # merged runs are removed only after the new run is written
+                self.add_temp(out.name)
+                self.scratch_size -= size
+
+        self.merge_runs(self.tmp_files, self.out)
+        self.tmp_files = []
 
-        self.write_to_file(heapq.merge(*open_files), self.out)
+    def merge_runs(self, names, out):
+        """Merge sorted runs into out and remove them"""
+        open_files = [self.open_run(name) for name in names]
 
-        for out, name in zip(open_files, self.tmp_files):
-            out.close()
-            os.remove(name)
+        try:
+            self.write_to_file(heapq.merge(*open_files), out)
+        finally:
+            for fh, name in zip(open_files, names):
+                fh.close()
+                if name not in self.keep_files:
+                    os.remove(name)
+
+    def add_run(self, name, keep=False):
+        """Add an already sorted file to be merged on flush.
+        The file is removed once merged, unless keep is set"""
+        if keep:
+            self.keep_files.add(name)
+            self.tmp_files.append(name)
+        else:
+            self.add_temp(name)
 
-    def write_to_temp(self):
-        self.sortedlist.sort()
-        with NamedTemporaryFile(mode="wt", delete=False) as out:
-            self.write_to_file(self.sortedlist, out)
+    def write_to_temp(self, lines):
+        lines.sort()
+        with self.open_temp("wb") as out:
+            self.write_to_file(lines, out)
 
         return out.name
 
+    def open_temp(self, mode):
+        if not self.compress_runs:
+            return NamedTemporaryFile(mode=mode, dir=self.tmp_dir, delete=False)
+
+        tmp = NamedTemporaryFile(
+            mode="wb", suffix=self.COMPRESSED_RUN_EXT, dir=self.tmp_dir, delete=False
+        )
+        return CompressedRun(tmp)
+
+    def open_run(self, name):
+        if name.endswith(self.COMPRESSED_RUN_EXT):
+            return gzip.open(name, "rb")
+
+        return open(name, "rb")
+
     def write_to_file(self, iter_, out):
-        lastline = None
-        for line in iter_:
-            if lastline != line:
+        if not self.dedup:
+            for line in iter_:
                 out.write(line)
-            lastline = line
+
+        else:
+            lastline = None
+            for line in iter_:
+                if lastline != line:
+                    out.write(line)
+                lastline = line
 
         out.flush()
 
 
+# ============================================================================
+class CompressedRun:
+    """Temp file for a sorted run, compressed as a fast gzip stream"""
+
+    COMPRESS_LEVEL = 1
+
+    def __init__(self, tmp):
+        self.tmp = tmp
+        self.name = tmp.name
+        self.fh = gzip.GzipFile(
+            fileobj=tmp, mode="wb", compresslevel=self.COMPRESS_LEVEL
+        )
+
+    def write(self, line):
+        self.fh.write(line)
+
+    def flush(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fh.close()
+        self.tmp.close()
+
+
+# ============================================================================
+class DedupWriter:
+    """Writer which drops index lines of captures already written, eg. from
+    copies of the same WARC at different paths. Lines are compared by a hash
+    of key_func(line), and only the hashes of the last max_keys lines are
+    kept, bounding memory use. Lines with a key of None are always written"""
+
+    DEFAULT_MAX_KEYS = 1000000
+
+    def __init__(self, out, key_func=None, max_keys=None):
+        self.out = wrap_output(out)
+        self.key_func = key_func
+        self.max_keys = max_keys or self.DEFAULT_MAX_KEYS
+
+        self.keys = set()
+        self.key_order = deque()
+        self.num_dropped = 0
+
+    def write(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+
+        key = self.key_func(line) if self.key_func else line
+        if key is None:
+            self.out.write(line)
+            return
+
+        key = hash(key)
+        if key in self.keys:
+            self.num_dropped += 1
+            return
+
+        self.keys.add(key)
+        self.key_order.append(key)
+        if len(self.key_order) > self.max_keys:
+            self.keys.discard(self.key_order.popleft())
+
+        self.out.write(line)
+
+    def flush(self):
+        self.out.flush()
+
+
+# ============================================================================
+class OutputWriter:
+    """Buffered writer of index lines, as utf-8 bytes or str, to a binary
+    output, or to a text output, such as StringIO"""
+
+    WRITE_BUFF_SIZE = 1024 * 256
+
+    def __init__(self, out):
+        self.out = out
+        self.text = is_text_output(out)
+        self.buff = []
+        self.size = 0
+
+    def write(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+
+        self.buff.append(line)
+        self.size += len(line)
+
+        if self.size >= self.WRITE_BUFF_SIZE:
+            self.write_buff()
+
+    def write_buff(self):
+        data = b"".join(self.buff)
+        self.out.write(data.decode("utf-8") if self.text else data)
+        self.buff = []
+        self.size = 0
+
+    def flush(self):
+        if self.buff:
+            self.write_buff()
+
+        self.out.flush()
+
+
+def is_text_output(out):
+    if isinstance(out, TextIOBase):
+        return True
+
+    mode = getattr(out, "mode", None)
+    return isinstance(mode, str) and "b" not in mode
+
+
+def wrap_output(out):
+    if isinstance(out, (OutputWriter, SortingWriter, CompressedWriter, DedupWriter)):
+        return out
+
+    return OutputWriter(out)
+
+
+def get_stdout():
+    """Return binary stdout, if available"""
+    sys.stdout.flush()
+    return getattr(sys.stdout, "buffer", sys.stdout)
+
+
+def get_stdin():
+    return getattr(sys.stdin, "buffer", sys.stdin)
+
+
 # ============================================================================
 class CompressedWriter:
     def __init__(
@@ -428,56 +1240,171 @@ class CompressedWriter:
         num_lines=CDXJIndexer.DEFAULT_NUM_LINES,
         data_out_name="",
         digest_records=False,
+        threads=None,
+        block_bytes=None,
+        block_bytes_compressed=False,
+        codec=zlib,
     ):
-        self.index_out = index_out
+        self.index_out = wrap_output(index_out)
         self.data_out = data_out
         self.data_out_name = data_out_name
         self.digest_records = digest_records
+        self.codec = codec
 
         self.block = []
         self.offset = 0
-        self.prefix = ""
+        self.prefix = b""
         self.num_lines = num_lines
+        self.header_written = False
+
+        # if set, blocks are cut once their size reaches block_bytes instead
+        # of every num_lines. For a compressed size target, the uncompressed
+        # size is estimated from the compression ratio of previous blocks
+        self.block_bytes = block_bytes
+        self.block_bytes_compressed = block_bytes_compressed
+        self.block_size = 0
+        self.total_size = 0
+
+        # if set, blocks are compressed and digested by a thread pool,
+        # and written in order as they complete
+        self.threads = threads
+        self.executor = None
+        self.pending = deque()
 
     def write_header(self):
         meta = json.dumps({"format": "cdxj-gzip-1.0", "filename": self.data_out_name})
 
-        self.index_out.write("!meta 0 {0}\n".format(meta))
+        self.index_out.write("!meta 0 {0}\n".format(meta).encode("utf-8"))
+        self.header_written = True
 
     def write(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+
         if not len(self.block):
-            self.prefix = line.split("{", 1)[0].strip()
-            if not self.offset:
+            self.prefix = line.split(b"{", 1)[0].strip()
+            if not self.header_written:
                 self.write_header()
 
         self.block.append(line)
+        self.block_size += len(line)
+
+        if self.block_bytes:
+            if self.block_size >= self.get_block_target():
+                self.flush_block()
+
+        elif len(self.block) == self.num_lines:
+            self.flush_block()
+
+    def get_block_target(self):
+        if not self.block_bytes_compressed:
+            return self.block_bytes
 
-        if len(self.block) == self.num_lines:
-            self.flush()
+        # the ratio is from written blocks only: with threads, wait for the
+        # first block, rather than sizing all pending blocks without a ratio
+        if not self.offset and self.pending:
+            self.write_pending()
+
+        if not self.offset:
+            return self.block_bytes
+
+        return self.block_bytes * self.total_size // self.offset
 
     def get_index_json(self, length, digest):
         data = {"offset": self.offset, "length": length}
         if digest:
             data["digest"] = digest
 
-        return json.dumps(data) + "\n"
+        return (json.dumps(data) + "\n").encode("utf-8")
 
     def flush(self):
-        comp = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
-        compressed = comp.compress("".join(self.block).encode("utf-8"))
-        compressed += comp.flush()
+        self.flush_block()
+
+        while self.pending:
+            self.write_pending()
+
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+        self.index_out.flush()
+
+    def flush_block(self):
+        data = b"".join(self.block)
+
+        size = len(data)
 
+        if not self.threads or self.threads <= 1:
+            compressed, digest = compress_block(data, self.digest_records, self.codec)
+            self.write_block(self.prefix, size, compressed, digest)
+        else:
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(self.threads)
+
+            # bound number of blocks in memory
+            if len(self.pending) >= self.threads * 2:
+                self.write_pending()
+
+            future = self.executor.submit(
+                compress_block, data, self.digest_records, self.codec
+            )
+            self.pending.append((self.prefix, size, future))
+
+        self.block = []
+        self.block_size = 0
+
+    def write_pending(self):
+        prefix, size, future = self.pending.popleft()
+        self.write_block(prefix, size, *future.result())
+
+    def write_block(self, prefix, size, compressed, digest):
         length = len(compressed)
-        digest = (
-            "sha256:" + hashlib.sha256(compressed).hexdigest()
-            if self.digest_records
-            else None
-        )
-        line = self.prefix + " " + self.get_index_json(length, digest)
+        line = prefix + b" " + self.get_index_json(length, digest)
         self.index_out.write(line)
         self.data_out.write(compressed)
         self.offset += length
-        self.block = []
+        self.total_size += size
+
+
+def compress_block(data, digest_records=False, codec=zlib):
+    """Compress a block as a single gzip member and optionally digest it.
+    zlib and hashlib release the GIL, so this may run in a worker thread"""
+    compressed = gzip_compress(data, codec)
+
+    digest = (
+        "sha256:" + hashlib.sha256(compressed).hexdigest() if digest_records else None
+    )
+    return compressed, digest
+
+
+# ============================================================================
+_key_cache = {}
+
+
+def dumps_index(index):
+    """Serialize index dict to JSON, identical to json.dumps(index)
+
+    >>> dumps_index({"url": "http://example.com/", "mime": "text/html"})
+    '{"url": "http://example.com/", "mime": "text/html"}'
+    >>> dumps_index({"url": "http://example.com/\u00e9", "status": 200})
+    '{"url": "http://example.com/\\\\u00e9", "status": 200}'
+    """
+    parts = []
+    for key, value in index.items():
+        if type(value) is not str or type(key) is not str:
+            return json.dumps(index)
+
+        enc_key = _key_cache.get(key)
+        if enc_key is None:
+            enc_key = _key_cache[key] = encode_basestring_ascii(key) + ": "
+
+        parts.append(enc_key + encode_basestring_ascii(value))
+
+    return "{" + ", ".join(parts) + "}"
+
+
+# request, response and other records in a capture share the same WARC-Date
+_cached_timestamp = lru_cache(maxsize=256)(iso_date_to_timestamp)
 
 
 # ============================================================================
@@ -513,6 +1440,65 @@ def main(args=None):
 
     parser.add_argument("-d", "--digest-records", action="store_true")
 
+    parser.add_argument("--compress-threads", type=int)
+
+    parser.add_argument("--gzip-codec", choices=["auto"] + list(CODECS))
+
+    parser.add_argument("--block-bytes", type=int)
+
+    parser.add_argument("--block-bytes-compressed", action="store_true")
+
+    parser.add_argument("--full-buffer", dest="lazy_buffer", action="store_false")
+
+    parser.add_argument("--no-skip-payload", dest="skip_payload", action="store_false")
+
+    parser.add_argument("--no-mmap", dest="mmap_input", action="store_false")
+
+    parser.add_argument("--dedup", action="store_true")
+
+    parser.add_argument("--dedup-max-keys", type=int)
+
+    parser.add_argument("--resolve-revisits", action="store_true")
+
+    parser.add_argument("--revisit-map-size", type=int)
+
+    parser.add_argument("--sort-tmp-dir")
+
+    parser.add_argument("--sort-compress-runs", action="store_true")
+
+    parser.add_argument("--sort-max-scratch", type=int)
+
+    parser.add_argument(
+        "--urlkey-cache-size", type=int, default=CDXJIndexer.DEFAULT_URLKEY_CACHE_SIZE
+    )
+
+    parser.add_argument("-w", "--workers", type=int)
+
+    parser.add_argument("--cache-dir")
+
+    parser.add_argument("--cache-hash", action="store_true")
+
+    parser.add_argument("--split-size", type=int)
+
+    parser.add_argument("--stats", action="store_true")
+
+    parser.add_argument("--stats-output")
+
+    parser.add_argument("--progress", action="store_true")
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if args and args[0] == "merge":
+        from cdxj_indexer.merge import main as merge_main
+
+        return merge_main(args[1:])
+
+    if args and args[0] == "segments":
+        from cdxj_indexer.segments import main as segments_main
+
+        return segments_main(args[1:])
+
     cmd = parser.parse_args(args=args)
 
     write_cdx_index(cmd.output, cmd.inputs, vars(cmd))
@@ -534,6 +1520,36 @@ def write_cdx_index(output, inputs, opts):
     return indexer
 
 
+# ============================================================================
+def _index_to_run(task):
+    """Index a single input, or a byte range of it, in a worker process
+    into a temp file, sorted if needed, and return the temp file name"""
+    cls, opts, input_, sort, byte_range, run_dir = task
+
+    with NamedTemporaryFile(
+        mode="wb",
+        suffix=".cdxj",
+        dir=run_dir or opts.get("sort_tmp_dir"),
+        delete=False,
+    ) as out:
+        try:
+            if byte_range:
+                with open(input_, "rb") as fh:
+                    reader = RangeReader(fh, *byte_range)
+                    indexer = cls(out, [reader], sort=sort, **opts)
+                    indexer.process_all()
+            else:
+                indexer = cls(out, [input_], sort=sort, **opts)
+                indexer.process_all()
+
+        except BaseException:
+            out.close()
+            os.remove(out.name)
+            raise
+
+    return out.name
+
+
 # =================================================================
 def iter_file_or_dir(inputs, recursive=True):
     for input_ in inputs:
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+from cdxj_indexer.bufferiter import BUFF_SIZE
+
+
+# ============================================================================
+class IndexManifest:
+    """Cache of per-file index runs, keyed by input path.
+
+    A cached run is reused while the input file is unchanged: same size and
+    mtime, or, if use_hash is set, same size and sha256 of its contents.
+    All cached runs are discarded if the index options change.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, cache_dir, opts_key, use_hash=False):
+        self.cache_dir = cache_dir
+        self.opts_key = opts_key
+        self.use_hash = use_hash
+        self.entries = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.manifest_path = os.path.join(cache_dir, self.MANIFEST_FILE)
+
+        try:
+            with open(self.manifest_path, "rt") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+
+        if data.get("opts") == opts_key:
+            self.entries = data.get("files", {})
+        else:
+            for entry in data.get("files", {}).values():
+                self.remove_runs(entry)
+
+    def check(self, path):
+        """Return (runs, info) for path, where runs is the list of cached run
+        files if path is unchanged, or None, and info describes the file to
+        store with new runs"""
+        stat = os.stat(path)
+        info = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        entry = self.entries.get(os.path.abspath(path))
+
+        if entry and entry["size"] == info["size"]:
+            if self.use_hash:
+                info["hash"] = get_file_hash(path)
+                unchanged = entry.get("hash") == info["hash"]
+            else:
+                unchanged = entry["mtime"] == info["mtime"]
+
+            if unchanged and all(map(os.path.isfile, self.get_runs(entry))):
+                return self.get_runs(entry), info
+
+        if self.use_hash and "hash" not in info:
+            info["hash"] = get_file_hash(path)
+
+        return None, info
+
+    def update(self, path, info, runs):
+        path = os.path.abspath(path)
+        if path in self.entries:
+            self.remove_runs(self.entries[path])
+
+        entry = dict(info)
+        entry["runs"] = [os.path.basename(run) for run in runs]
+        self.entries[path] = entry
+
+    def get_runs(self, entry):
+        return [os.path.join(self.cache_dir, run) for run in entry["runs"]]
+
+    def remove_runs(self, entry):
+        for run in self.get_runs(entry):
+            if os.path.isfile(run):
+                os.remove(run)
+
+    def prune(self):
+        """Remove cached runs of input files which no longer exist"""
+        for path in list(self.entries):
+            if not os.path.isfile(path):
+                self.remove_runs(self.entries.pop(path))
+
+    def save(self):
+        data = {"opts": self.opts_key, "files": self.entries}
+
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "wt") as fh:
+            json.dump(data, fh, indent=2)
+
+        os.replace(tmp_path, self.manifest_path)
+
+
+# ============================================================================
+def get_file_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while True:
+            buff = fh.read(BUFF_SIZE)
+            if not buff:
+                break
+
+            hasher.update(buff)
+
+    return "sha256:" + hasher.hexdigest()
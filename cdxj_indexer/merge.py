@@ -0,0 +1,226 @@
+import itertools
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+from warcio.utils import open_or_default
+
+from cdxj_indexer.main import (
+    CDXJIndexer,
+    SortingWriter,
+    CompressedWriter,
+    OutputWriter,
+    get_stdout,
+)
+from cdxj_indexer.reader import CDXJReader
+from cdxj_indexer.codec import CODECS, get_codec
+
+
+# ============================================================================
+class MergingWriter(SortingWriter):
+    """SortingWriter which merges existing sorted index files: CDXJ, CDX
+    with a ' CDX' header line, or ZipNum indexes, given the secondary index.
+    Input files are never removed."""
+
+    CDX_HEADER_PREFIX = b" CDX "
+
+    def add_index(self, name):
+        self.add_run(name, keep=True)
+
+    def open_run(self, name):
+        if name not in self.keep_files:
+            return super().open_run(name)
+
+        fh = super().open_run(name)
+        first = fh.readline()
+
+        if first.startswith(CDXJReader.META_PREFIX):
+            fh.close()
+            return ZipNumLines(CDXJReader(name))
+
+        if first.startswith(self.CDX_HEADER_PREFIX):
+            first = b""
+
+        return IndexLines(fh, first)
+
+
+# ============================================================================
+class IndexLines:
+    def __init__(self, fh, first):
+        self.fh = fh
+        self.first = first
+
+    def __iter__(self):
+        lines = itertools.chain([self.first], self.fh) if self.first else self.fh
+
+        for line in lines:
+            # last line may not end with a newline
+            if not line.endswith(b"\n"):
+                line += b"\n"
+
+            yield line
+
+    def close(self):
+        self.fh.close()
+
+
+# ============================================================================
+class ZipNumLines:
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __iter__(self):
+        for line in self.reader.iter_lines():
+            yield line + b"\n"
+
+    def close(self):
+        self.reader.close()
+
+
+# ============================================================================
+def merge_indexes(
+    output,
+    inputs,
+    compress=None,
+    data_out_name=None,
+    lines=CDXJIndexer.DEFAULT_NUM_LINES,
+    dedup=True,
+    tmp_dir=None,
+    max_fan_in=None,
+    gzip_codec=None,
+):
+    """Merge already sorted CDXJ, CDX or ZipNum indexes into a single sorted
+    index, optionally compressed as ZipNum. Inputs are streamed, merging at
+    most max_fan_in at a time"""
+    header = get_cdx_header(inputs)
+    check_formats(inputs)
+    data_out = None
+
+    with open_or_default(output, "wb", get_stdout()) as fh:
+        fh = OutputWriter(fh)
+        if header and not compress:
+            fh.write(header)
+
+        if compress:
+            if isinstance(compress, str):
+                data_out = open(compress, "wb")
+                data_out_name = data_out_name or compress
+                compress = data_out
+
+            fh = CompressedWriter(
+                fh,
+                data_out=compress,
+                data_out_name=data_out_name,
+                num_lines=lines,
+                codec=get_codec(gzip_codec or "zlib"),
+            )
+
+        writer = MergingWriter(fh, max_fan_in=max_fan_in, tmp_dir=tmp_dir, dedup=dedup)
+
+        for name in inputs:
+            writer.add_index(name)
+
+        writer.flush()
+
+    if data_out:
+        data_out.close()
+
+
+def get_cdx_header(inputs):
+    for name in inputs:
+        with open(name, "rb") as fh:
+            line = fh.readline()
+            if line.startswith(MergingWriter.CDX_HEADER_PREFIX):
+                return line
+
+    return None
+
+
+def check_formats(inputs):
+    """Raise ValueError if inputs are not all of the same index format"""
+    formats = {}
+    for name in inputs:
+        index_format = get_index_format(name)
+        if index_format:
+            formats.setdefault(index_format, name)
+
+    if len(formats) > 1:
+        raise ValueError(
+            "Can't merge indexes of different formats: "
+            + ", ".join("{1} ({0})".format(*item) for item in formats.items())
+        )
+
+
+def get_index_format(name):
+    """Return the format of index name from its CDX header or first line,
+    or None if it is empty"""
+    with open(name, "rb") as fh:
+        line = fh.readline()
+
+    # format of the compressed lines of a ZipNum index
+    if line.startswith(CDXJReader.META_PREFIX):
+        with CDXJReader(name) as reader:
+            line = next(reader.iter_lines(), b"")
+
+    return get_index_format_of_line(line)
+
+
+def get_index_format_of_line(line):
+    """Return "cdxj", or "cdx" and the number of fields of an index line
+
+    >>> get_index_format_of_line(b'com,example)/ 20170306040206 {"url": "x"}')
+    'cdxj'
+    >>> get_index_format_of_line(b" CDX N b a m s k r M S V g")
+    'cdx11'
+    >>> get_index_format_of_line(b"com,example)/ 20170306040206 x - - - - 0 f")
+    'cdx9'
+    """
+    if not line.strip():
+        return None
+
+    if line.startswith(MergingWriter.CDX_HEADER_PREFIX):
+        return "cdx{0}".format(len(line.split()) - 1)
+
+    parts = line.split(b" ", 2)
+    if len(parts) == 3 and parts[2].startswith(b"{"):
+        return "cdxj"
+
+    return "cdx{0}".format(len(line.split()))
+
+
+# ============================================================================
+def main(args=None):
+    parser = ArgumentParser(
+        description="cdx_indexer merge", formatter_class=RawTextHelpFormatter
+    )
+
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("-o", "--output")
+
+    parser.add_argument("-c", "--compress")
+
+    parser.add_argument(
+        "-l", "--lines", type=int, default=CDXJIndexer.DEFAULT_NUM_LINES
+    )
+
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false")
+
+    parser.add_argument("--tmp-dir")
+
+    parser.add_argument("--gzip-codec", choices=["auto"] + list(CODECS))
+
+    cmd = parser.parse_args(args=args)
+
+    merge_indexes(
+        cmd.output,
+        cmd.inputs,
+        compress=cmd.compress,
+        lines=cmd.lines,
+        dedup=cmd.dedup,
+        tmp_dir=cmd.tmp_dir,
+        gzip_codec=cmd.gzip_codec,
+    )
+
+
+# ============================================================================
+if __name__ == "__main__":  # pragma: no cover
+    main()
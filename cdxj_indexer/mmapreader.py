@@ -0,0 +1,150 @@
+import hashlib
+import io
+import mmap
+import os
+import stat
+
+from warcio.limitreader import LimitReader
+
+from cdxj_indexer.skipiter import get_buffered, has_reader_state
+from cdxj_indexer.splitter import GZIP_MAGIC
+
+
+# ============================================================================
+class MmapReader(io.RawIOBase):
+    """Seekable reader of an uncompressed WARC or ARC file mapped into memory.
+
+    Reads are slices of the mapping, without a read() call per block.
+    Record digests are computed on a memoryview of the mapping, and the
+    content of a record, eg. a POST body, can be read from the mapping
+    instead of being copied to a buffer as the record is read.
+    """
+
+    def __init__(self, fh, mm):
+        super().__init__()
+        self.fh = fh
+        self.mm = mm
+        self.size = len(mm)
+        self.pos = fh.tell()
+        self.record_start = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = self.size
+        if size is not None and size >= 0:
+            end = min(self.pos + size, end)
+
+        buff = self.mm[self.pos : end]
+        self.pos += len(buff)
+        return buff
+
+    def readinto(self, buff):
+        data = self.read(len(buff))
+        buff[: len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def close(self):
+        if not self.closed:
+            self.mm.close()
+            if not self.fh.closed:
+                self.fh.seek(min(self.pos, self.size))
+
+        super().close()
+
+    # record digests, with the same interface as DigestingReader
+    def begin_record(self, offset):
+        self.record_start = offset
+
+    def end_record(self, length):
+        end = min(self.record_start + length, self.size)
+
+        with memoryview(self.mm)[self.record_start : end] as view:
+            digest = "sha256:" + hashlib.sha256(view).hexdigest()
+
+        return digest, end - self.record_start
+
+    def open_payload(self, it, record):
+        """Return a reader of the unread content of the current record of
+        archive iterator it, or None if the content is encoded"""
+        if not has_reader_state(it):
+            return None
+
+        stream = record.raw_stream
+        if not isinstance(stream, LimitReader) or stream.stream is not it.reader:
+            return None
+
+        if it.reader.decompressor or record.content_stream() is not stream:
+            return None
+
+        start = self.pos - get_buffered(it.reader)
+        return MmapRegion(self.mm, start, start + stream.limit)
+
+
+# ============================================================================
+class MmapRegion:
+    """Reader of the byte range [start, end) of a mapping, which does not
+    change the position of the file reader"""
+
+    def __init__(self, mm, start, end):
+        self.mm = mm
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    def read(self, size=-1):
+        end = self.end
+        if size is not None and size >= 0:
+            end = min(self.pos + size, end)
+
+        buff = self.mm[self.pos : end]
+        self.pos += len(buff)
+        return buff
+
+    def seek(self, offset):
+        self.pos = self.start + offset
+
+    def close(self):
+        pass
+
+
+# ============================================================================
+def open_mmap(fh):
+    """Return an MmapReader for fh, an open regular file which is not
+    gzipped, or None if fh can't be mapped"""
+    try:
+        fileno = fh.fileno()
+        pos = fh.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    info = os.fstat(fileno)
+    if not stat.S_ISREG(info.st_mode) or info.st_size <= pos:
+        return None
+
+    try:
+        mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if mm[pos : pos + len(GZIP_MAGIC)] == GZIP_MAGIC:
+        mm.close()
+        return None
+
+    return MmapReader(fh, mm)
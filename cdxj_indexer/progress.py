@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+
+from cdxj_indexer.stats import get_pos
+
+
+# ============================================================================
+class ProgressReporter:
+    """Periodic progress events for an indexing run, passed to callback(event)
+    as a dict with files and bytes done and total, records, rates and ETA.
+
+    Progress is checked once every check_records records, and reported at
+    most once per interval seconds, and once when indexing is done.
+    """
+
+    DEFAULT_INTERVAL = 1.0
+
+    CHECK_RECORDS = 1000
+
+    def __init__(self, callback, interval=None, check_records=None):
+        self.callback = callback
+        self.interval = interval if interval is not None else self.DEFAULT_INTERVAL
+        self.check_records = check_records or self.CHECK_RECORDS
+
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.curr_bytes = 0
+        self.records = 0
+        self.next_check = self.check_records
+
+        self.start_time = None
+        self.last_report = None
+
+    def begin(self, inputs):
+        self.files_total = len(inputs)
+        self.bytes_total = sum(get_size(input_) or 0 for input_ in inputs)
+        self.start_time = self.last_report = time.monotonic()
+
+    def iter_records(self, record_iter, fh):
+        start_pos = get_pos(fh)
+
+        for record in record_iter:
+            self.records += 1
+            if self.records >= self.next_check:
+                self.next_check = self.records + self.check_records
+                self.update(start_pos, fh)
+
+            yield record
+
+        self.update_bytes(start_pos, fh)
+
+    def update(self, start_pos, fh):
+        self.update_bytes(start_pos, fh)
+        self.report("progress")
+
+    def update_bytes(self, start_pos, fh):
+        pos = get_pos(fh)
+        if start_pos is not None and pos is not None:
+            self.curr_bytes = pos - start_pos
+
+    def file_done(self, size=None):
+        self.files_done += 1
+        self.bytes_done += size if size is not None else self.curr_bytes
+        self.curr_bytes = 0
+        self.report("file")
+
+    def end(self):
+        self.report("done", force=True)
+
+    def report(self, event, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+
+        self.last_report = now
+        self.callback(self.get_event(event, now))
+
+    def get_event(self, event, now):
+        elapsed = now - self.start_time
+        bytes_done = self.bytes_done + self.curr_bytes
+
+        bytes_per_sec = bytes_done / elapsed if elapsed > 0 else 0
+        eta = None
+        if self.bytes_total and bytes_per_sec:
+            eta = max(self.bytes_total - bytes_done, 0) / bytes_per_sec
+
+        return {
+            "event": event,
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "bytes_done": bytes_done,
+            "bytes_total": self.bytes_total,
+            "records": self.records,
+            "elapsed": elapsed,
+            "records_per_sec": self.records / elapsed if elapsed > 0 else 0,
+            "bytes_per_sec": bytes_per_sec,
+            "eta": eta,
+        }
+
+
+# ============================================================================
+def get_size(input_):
+    if isinstance(input_, str) and os.path.isfile(input_):
+        return os.path.getsize(input_)
+
+    return None
+
+
+def print_progress(event, out=None):
+    """Default progress callback, writing a progress line to stderr"""
+    out = out or sys.stderr
+
+    line = "files {0}/{1}".format(event["files_done"], event["files_total"])
+
+    if event["bytes_total"]:
+        line += ", {0:.1f}/{1:.1f} MB ({2:.0%})".format(
+            event["bytes_done"] / 1024 / 1024,
+            event["bytes_total"] / 1024 / 1024,
+            min(event["bytes_done"] / event["bytes_total"], 1),
+        )
+
+    line += ", {0} records, {1:.0f} rec/s, {2:.1f} MB/s".format(
+        event["records"],
+        event["records_per_sec"],
+        event["bytes_per_sec"] / 1024 / 1024,
+    )
+
+    if event["event"] == "done":
+        line += ", done in {0:.1f}s".format(event["elapsed"])
+    elif event["eta"] is not None:
+        line += ", ETA {0:.0f}s".format(event["eta"])
+
+    out.write(line + "\n")
+    out.flush()
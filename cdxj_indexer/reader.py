@@ -0,0 +1,187 @@
+import json
+import mmap
+import os
+import zlib
+
+from bisect import bisect_left
+
+
+# ============================================================================
+class CDXJReader:
+    """Lookup of index lines by urlkey and timestamp in a sorted CDXJ (or CDX)
+    file, or in a compressed ZipNum index produced by CompressedWriter.
+
+    For a plain index, lines are found by binary search over a memory-mapped
+    file. For a ZipNum index, the secondary index is searched, and only the
+    needed compressed blocks are read from the data file.
+    """
+
+    META_PREFIX = b"!meta "
+
+    def __init__(self, filename, data_filename=None):
+        self.filename = filename
+        self.fh = open(filename, "rb")
+        self.mm = self._mmap(self.fh)
+
+        self.blocks = None
+        self.data_fh = None
+        self.data_mm = None
+
+        if self.mm[: len(self.META_PREFIX)] == self.META_PREFIX:
+            self._load_secondary_index(data_filename)
+
+    @staticmethod
+    def _mmap(fh):
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b""
+
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_secondary_index(self, data_filename):
+        self.block_keys = []
+        self.blocks = []
+
+        for line in iter_lines(self.mm):
+            prefix, data = line.split(b" {", 1)
+            data = json.loads(b"{" + data)
+
+            if prefix.startswith(self.META_PREFIX):
+                data_filename = data_filename or self._resolve_data_filename(
+                    data.get("filename")
+                )
+                continue
+
+            self.block_keys.append(prefix)
+            self.blocks.append((data["offset"], data["length"]))
+
+        self.data_fh = open(data_filename, "rb")
+        self.data_mm = self._mmap(self.data_fh)
+
+    def _resolve_data_filename(self, name):
+        if os.path.isabs(name) or os.path.isfile(name):
+            return name
+
+        return os.path.join(os.path.dirname(self.filename), name)
+
+    def close(self):
+        for mm in (self.mm, self.data_mm):
+            if isinstance(mm, mmap.mmap):
+                mm.close()
+
+        for fh in (self.fh, self.data_fh):
+            if fh:
+                fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def lookup(self, urlkey, match="exact", from_ts=None, to_ts=None):
+        """Yield index lines for urlkey, as str without trailing newline.
+
+        match may be "exact" for lines with this urlkey, or "prefix" for
+        all urlkeys starting with urlkey. Lines may be limited to timestamps
+        from_ts to to_ts, inclusive. Partial timestamps, eg. "2017", match
+        all timestamps they are a prefix of.
+        """
+        if match == "exact":
+            key = urlkey + " "
+            start = key + (from_ts or "")
+            return self._iter_matching(start, key.__le__, key, from_ts, to_ts)
+
+        elif match == "prefix":
+            return self._iter_matching(urlkey, urlkey.__le__, urlkey, from_ts, to_ts)
+
+        raise ValueError("Unknown match type: " + match)
+
+    def range(self, start, end=None, from_ts=None, to_ts=None):
+        """Yield index lines with urlkey >= start and < end"""
+        end_func = (lambda line: line < end) if end else None
+        return self._iter_matching(start, start.__le__, None, from_ts, to_ts, end_func)
+
+    def iter_lines(self):
+        """Yield all index lines, as bytes without trailing newline"""
+        if self.blocks is None:
+            return iter_lines(self.mm)
+
+        return self._iter_blocks(0)
+
+    def _iter_matching(self, start, start_func, prefix, from_ts, to_ts, end_func=None):
+        from_ts = pad_timestamp(from_ts, "0")
+        to_ts = pad_timestamp(to_ts, "9")
+
+        for line in self._iter_from(start.encode("utf-8")):
+            line = line.decode("utf-8")
+
+            if not start_func(line):
+                continue
+
+            if prefix is not None and not line.startswith(prefix):
+                break
+
+            if end_func and not end_func(line):
+                break
+
+            if from_ts or to_ts:
+                ts = line.split(" ", 2)[1]
+                if from_ts and ts < from_ts:
+                    continue
+
+                if to_ts and ts > to_ts:
+                    continue
+
+            yield line
+
+    def _iter_from(self, key):
+        if self.blocks is None:
+            return iter_lines(self.mm, bisect_lines(self.mm, key))
+
+        return self._iter_blocks(max(bisect_left(self.block_keys, key) - 1, 0))
+
+    def _iter_blocks(self, index):
+        for offset, length in self.blocks[index:]:
+            data = zlib.decompress(
+                self.data_mm[offset : offset + length], 16 + zlib.MAX_WBITS
+            )
+            yield from iter_lines(data)
+
+
+# ============================================================================
+def bisect_lines(buff, key):
+    """Return offset of the first line in sorted buff which is >= key"""
+    lo = 0
+    hi = len(buff)
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = buff.rfind(b"\n", 0, mid) + 1
+        end = buff.find(b"\n", start)
+        if end < 0:
+            end = len(buff)
+
+        if buff[start:end] < key:
+            lo = end + 1
+        else:
+            hi = start
+
+    return lo
+
+
+def iter_lines(buff, offset=0):
+    size = len(buff)
+    while offset < size:
+        end = buff.find(b"\n", offset)
+        if end < 0:
+            end = size
+
+        yield buff[offset:end]
+        offset = end + 1
+
+
+def pad_timestamp(ts, digit):
+    if not ts:
+        return None
+
+    return ts + digit * (14 - len(ts))
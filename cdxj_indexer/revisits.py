@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+
+# ============================================================================
+class DigestMap:
+    """Map of payload digest to the first capture added with that digest.
+
+    Up to max_size digests are kept in memory, then all are moved to an
+    on-disk table in a temp dir, so that memory use stays bounded for large
+    crawls. The temp dir is removed by close().
+    """
+
+    DEFAULT_MAX_SIZE = 500000
+
+    def __init__(self, max_size=None, tmp_dir=None):
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        self.tmp_dir = tmp_dir
+
+        self.mem = {}
+        self.db = None
+        self.db_dir = None
+        self.num_spills = 0
+
+    def add(self, digest, value):
+        """Add value, a tuple of str, for digest, unless already added"""
+        if digest in self.mem:
+            return
+
+        self.mem[digest] = value
+        if len(self.mem) >= self.max_size:
+            self.spill()
+
+    def get(self, digest):
+        # digests on disk were added before those in memory
+        if self.db:
+            row = self.db.execute(
+                "SELECT value FROM digests WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row:
+                return tuple(json.loads(row[0]))
+
+        return self.mem.get(digest)
+
+    def spill(self):
+        if not self.db:
+            self.db_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+            self.db = sqlite3.connect(os.path.join(self.db_dir, "digests.db"))
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute(
+                "CREATE TABLE digests (digest TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID"
+            )
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO digests VALUES (?, ?)",
+                ((digest, json.dumps(value)) for digest, value in self.mem.items()),
+            )
+
+        self.mem = {}
+        self.num_spills += 1
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+        if self.db_dir:
+            shutil.rmtree(self.db_dir, ignore_errors=True)
+            self.db_dir = None
+
+        self.mem = {}
@@ -0,0 +1,279 @@
+import heapq
+import json
+import os
+import sys
+import threading
+import uuid
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+from cdxj_indexer.main import CDXJIndexer, write_cdx_index
+from cdxj_indexer.merge import merge_indexes
+from cdxj_indexer.reader import CDXJReader
+
+
+# ============================================================================
+class SegmentedIndex:
+    """A directory of sorted ZipNum index segments, updated incrementally.
+
+    New records are indexed into a new small segment, instead of rewriting
+    the whole index. Lookups consult all segments. Once the number of
+    segments exceeds max_segments, or the segments other than the largest
+    one exceed compact_size bytes, the segments should be compacted into one.
+
+    A single writer (adding or compacting) is assumed per directory.
+    """
+
+    SEGMENTS_FILE = "segments.json"
+
+    SEGMENT_INDEX_EXT = ".cdxj"
+    SEGMENT_DATA_EXT = ".cdxj.gz"
+
+    DEFAULT_MAX_SEGMENTS = 8
+
+    DEFAULT_COMPACT_SIZE = 1024 * 1024 * 256
+
+    def __init__(
+        self,
+        path,
+        max_segments=DEFAULT_MAX_SEGMENTS,
+        compact_size=DEFAULT_COMPACT_SIZE,
+        lines=CDXJIndexer.DEFAULT_NUM_LINES,
+    ):
+        self.path = path
+        self.max_segments = max_segments
+        self.compact_size = compact_size
+        self.lines = lines
+
+        self.lock = threading.Lock()
+        self.readers = {}
+
+        # number of running lookups per segment, and compacted segments to
+        # remove once no lookup uses them
+        self.refs = {}
+        self.retired = set()
+
+        os.makedirs(path, exist_ok=True)
+
+    def get_segments(self):
+        try:
+            with open(os.path.join(self.path, self.SEGMENTS_FILE), "rt") as fh:
+                return json.load(fh)["segments"]
+        except FileNotFoundError:
+            return []
+
+    def _save_segments(self, segments):
+        filename = os.path.join(self.path, self.SEGMENTS_FILE)
+        with open(filename + ".tmp", "wt") as fh:
+            json.dump({"segments": segments}, fh, indent=2)
+
+        os.replace(filename + ".tmp", filename)
+
+    def _index_path(self, name):
+        return os.path.join(self.path, name + self.SEGMENT_INDEX_EXT)
+
+    def _data_path(self, name):
+        return os.path.join(self.path, name + self.SEGMENT_DATA_EXT)
+
+    def _new_segment_name(self):
+        return "segment-" + uuid.uuid4().hex
+
+    def get_segment_size(self, name):
+        return os.path.getsize(self._data_path(name))
+
+    def add_segment(self, inputs, opts=None):
+        """Index inputs into a new sorted, compressed segment"""
+        opts = dict(opts or {})
+        opts["sort"] = True
+        opts.setdefault("lines", self.lines)
+
+        name = self._new_segment_name()
+        opts["data_out_name"] = os.path.basename(self._data_path(name))
+
+        with open(self._data_path(name), "wb") as data_out:
+            opts["compress"] = data_out
+            write_cdx_index(self._index_path(name), inputs, opts)
+
+        with self.lock:
+            self._save_segments(self.get_segments() + [name])
+
+        return name
+
+    def needs_compaction(self):
+        segments = self.get_segments()
+        if len(segments) <= 1:
+            return False
+
+        if len(segments) > self.max_segments:
+            return True
+
+        sizes = sorted(map(self.get_segment_size, segments))
+        return sum(sizes[:-1]) > self.compact_size
+
+    def compact(self, background=False):
+        """Merge all current segments into one. If background is set,
+        compaction runs in a thread, which is returned. Lookups use the
+        existing segments until compaction is complete"""
+        if background:
+            thread = threading.Thread(target=self.compact)
+            thread.start()
+            return thread
+
+        segments = self.get_segments()
+        if len(segments) <= 1:
+            return None
+
+        name = self._new_segment_name()
+
+        with open(self._data_path(name), "wb") as data_out:
+            merge_indexes(
+                self._index_path(name),
+                [self._index_path(segment) for segment in segments],
+                compress=data_out,
+                data_out_name=os.path.basename(self._data_path(name)),
+                lines=self.lines,
+            )
+
+        # replace merged segments, keeping any segments added meanwhile
+        with self.lock:
+            current = self.get_segments()
+            self._save_segments(
+                [name] + [segment for segment in current if segment not in segments]
+            )
+
+            for segment in segments:
+                if self.refs.get(segment):
+                    self.retired.add(segment)
+                else:
+                    self._remove_segment(segment)
+
+        return name
+
+    def _remove_segment(self, segment):
+        reader = self.readers.pop(segment, None)
+        if reader:
+            reader.close()
+
+        os.remove(self._index_path(segment))
+        os.remove(self._data_path(segment))
+        self.retired.discard(segment)
+
+    def _get_reader(self, segment):
+        reader = self.readers.get(segment)
+        if not reader:
+            reader = CDXJReader(self._index_path(segment))
+            self.readers[segment] = reader
+
+        return reader
+
+    def lookup(self, urlkey, match="exact", from_ts=None, to_ts=None):
+        """Yield matching lines from all segments, in sorted order,
+        with the same arguments as CDXJReader.lookup()"""
+        with self.lock:
+            segments = self.get_segments()
+            readers = [self._get_reader(segment) for segment in segments]
+            for segment in segments:
+                self.refs[segment] = self.refs.get(segment, 0) + 1
+
+        try:
+            lastline = None
+            for line in heapq.merge(
+                *[reader.lookup(urlkey, match, from_ts, to_ts) for reader in readers]
+            ):
+                if line != lastline:
+                    yield line
+                lastline = line
+
+        finally:
+            self._release(segments)
+
+    def _release(self, segments):
+        # segments compacted during the lookup are removed by the last user
+        with self.lock:
+            for segment in segments:
+                self.refs[segment] -= 1
+                if not self.refs[segment]:
+                    del self.refs[segment]
+                    if segment in self.retired:
+                        self._remove_segment(segment)
+
+    def close(self):
+        with self.lock:
+            for reader in self.readers.values():
+                reader.close()
+
+            self.readers = {}
+
+            for segment in list(self.retired):
+                self._remove_segment(segment)
+
+            self.refs = {}
+
+
+# ============================================================================
+def main(args=None):
+    parser = ArgumentParser(
+        description="cdx_indexer segments", formatter_class=RawTextHelpFormatter
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add = subparsers.add_parser("add")
+    add.add_argument("dir")
+    add.add_argument("inputs", nargs="+")
+    add.add_argument("-f", "--fields")
+    add.add_argument("--records")
+    add.add_argument("--dir-root")
+    add.add_argument("-p", "--post-append", action="store_true")
+    add.add_argument("--no-compact", dest="compact", action="store_false")
+
+    compact = subparsers.add_parser("compact")
+    compact.add_argument("dir")
+    compact.add_argument("--force", action="store_true")
+
+    lookup = subparsers.add_parser("lookup")
+    lookup.add_argument("dir")
+    lookup.add_argument("urlkey")
+    lookup.add_argument("--match", default="exact")
+    lookup.add_argument("--from-ts")
+    lookup.add_argument("--to-ts")
+
+    for subparser in (add, compact):
+        subparser.add_argument("--max-segments", type=int)
+        subparser.add_argument("--compact-size", type=int)
+        subparser.add_argument("-l", "--lines", type=int)
+
+    cmd = parser.parse_args(args=args)
+
+    kwargs = {}
+    for name in ("max_segments", "compact_size", "lines"):
+        if getattr(cmd, name, None):
+            kwargs[name] = getattr(cmd, name)
+
+    index = SegmentedIndex(cmd.dir, **kwargs)
+
+    if cmd.command == "add":
+        opts = dict(
+            fields=cmd.fields,
+            records=cmd.records,
+            dir_root=cmd.dir_root,
+            post_append=cmd.post_append,
+        )
+        index.add_segment(cmd.inputs, opts)
+        if cmd.compact and index.needs_compaction():
+            index.compact()
+
+    elif cmd.command == "compact":
+        if cmd.force or index.needs_compaction():
+            index.compact()
+
+    elif cmd.command == "lookup":
+        for line in index.lookup(cmd.urlkey, cmd.match, cmd.from_ts, cmd.to_ts):
+            sys.stdout.write(line + "\n")
+
+    index.close()
+
+
+# ============================================================================
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,179 @@
+import io
+import os
+import struct
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.limitreader import LimitReader
+
+from cdxj_indexer.splitter import GZIP_MAGIC, read_member_headers
+
+SKIP_SCAN_SIZE = 1024 * 64
+
+# max uncompressed bytes after the record block in a gzip member,
+# for blank lines between records
+MAX_MEMBER_TRAILING = 16
+
+# private state of warcio's BufferedReader, read and replaced to skip records
+READER_STATE = ("buff", "buff_size", "num_block_read", "decompressor", "block_size")
+
+
+# ============================================================================
+class SkippingArchiveIterator(ArchiveIterator):
+    """ArchiveIterator which skips the unread rest of each record, instead of
+    reading it to find the next record, if the input is a seekable file.
+
+    For uncompressed files, the rest of the record block is skipped by
+    seeking past it. For gzipped WARCs, the next gzip member is found by
+    scanning the compressed data, without decompressing it: a candidate
+    member must follow a gzip trailer with the expected uncompressed size
+    of the current member, and must start with a WARC record. Records whose
+    content has been read, eg. to compute a digest, are not affected.
+
+    Skipped data is not checked, so a corrupt payload is not detected.
+    Records are read in full if the warcio reader state is not as expected.
+    """
+
+    MIN_GZIP_SKIP = 1024 * 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.skipped = 0
+        self.can_skip = has_reader_state(self) and self._can_seek()
+
+    def read_to_end(self, record=None):
+        if self.record and not self.member_info and self.can_skip:
+            stream = self.record.raw_stream
+            if isinstance(stream, LimitReader) and stream.stream is self.reader:
+                if not self.reader.decompressor:
+                    self._skip_uncompressed(stream)
+                elif self.record.format == "warc":
+                    self._skip_gzip(stream)
+
+        return super().read_to_end(record)
+
+    def _can_seek(self):
+        return isinstance(self.fh, io.IOBase) and self.fh.seekable()
+
+    def _skip_uncompressed(self, stream):
+        buffered = get_buffered(self.reader)
+        if stream.limit <= buffered:
+            return
+
+        # a truncated record is read instead, to end where reading it ends
+        pos = self.fh.tell()
+        if self.fh.seek(0, os.SEEK_END) - pos < stream.limit - buffered:
+            self.fh.seek(pos)
+            return
+
+        self.fh.seek(pos)
+        stream.read(buffered)
+
+        self.fh.seek(stream.limit, os.SEEK_CUR)
+        self.skipped += stream.limit
+        stream.limit = 0
+
+    def _skip_gzip(self, stream):
+        reader = self.reader
+        if reader.decompressor.unused_data:
+            return
+
+        buffered = get_buffered(self.reader)
+        if stream.limit <= buffered + self.MIN_GZIP_SKIP:
+            return
+
+        member_size = reader.num_block_read - buffered + stream.limit
+
+        pos = self.fh.tell()
+        next_offset = find_next_member(self.fh, pos, member_size)
+        if next_offset is None:
+            self.fh.seek(pos)
+            return
+
+        self.fh.seek(next_offset)
+        data = self.fh.read(reader.block_size)
+
+        # continue as if the member was fully read, with the start of
+        # the next member as unused data
+        reader.buff = None
+        reader.buff_size = 0
+        reader.decompressor = SkippedMember(data)
+
+        self.skipped += stream.limit
+        stream.limit = 0
+
+
+# ============================================================================
+class SkippedMember:
+    """Stands in for the decompressor of a skipped gzip member"""
+
+    def __init__(self, unused_data):
+        self.unused_data = unused_data
+
+    def decompress(self, data):
+        return b""
+
+    def flush(self):
+        return b""
+
+
+# ============================================================================
+def find_next_member(fh, pos, member_size):
+    """Return offset of the gzip member after the member being read at pos,
+    which has member_size uncompressed bytes, not counting blank lines at
+    the end. Return the file size if the member is the last one, or None
+    if not found"""
+    size = fh.seek(0, os.SEEK_END)
+
+    while pos < size:
+        fh.seek(pos)
+        buff = fh.read(SKIP_SCAN_SIZE)
+
+        i = buff.find(GZIP_MAGIC)
+        while i >= 0:
+            offset = pos + i
+            if is_member_end(fh, offset, member_size) and read_member_headers(
+                fh, offset
+            ):
+                return offset
+
+            i = buff.find(GZIP_MAGIC, i + 1)
+
+        if len(buff) < SKIP_SCAN_SIZE:
+            break
+
+        pos += len(buff) - len(GZIP_MAGIC) + 1
+
+    if is_member_end(fh, size, member_size):
+        return size
+
+    return None
+
+
+def has_reader_state(it):
+    """Return true if archive iterator it has the private warcio state used
+    to skip records, which may change between warcio releases"""
+    if not hasattr(it, "member_info"):
+        return False
+
+    return all(hasattr(it.reader, name) for name in READER_STATE)
+
+
+def get_buffered(reader):
+    """Return number of bytes read from the input by reader, but not yet
+    returned by it"""
+    if not reader.buff:
+        return 0
+
+    return reader.buff_size - reader.buff.tell()
+
+
+def is_member_end(fh, offset, member_size):
+    """Return true if offset follows a gzip trailer for a member with
+    member_size uncompressed bytes, plus trailing blank lines"""
+    if offset < 8:
+        return False
+
+    fh.seek(offset - 4)
+    isize = struct.unpack("<I", fh.read(4))[0]
+
+    return (isize - member_size) % (1 << 32) <= MAX_MEMBER_TRAILING
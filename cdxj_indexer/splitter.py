@@ -0,0 +1,137 @@
+import os
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+
+SCAN_SIZE = 1024 * 256
+
+MAX_HEADER_SIZE = 1024 * 64
+
+
+# ============================================================================
+class RangeReader:
+    """Read-only view of the byte range [start, end) of a seekable file.
+    Positions reported by tell() are absolute, so that record offsets
+    computed from this reader match those of the full file."""
+
+    def __init__(self, fh, start, end):
+        self.fh = fh
+        self.start = start
+        self.end = end
+        self.fh.seek(start)
+        self.pos = start
+
+    def read(self, size=-1):
+        remaining = self.end - self.pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
+        buff = self.fh.read(size)
+        self.pos += len(buff)
+        return buff
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.fh.seek(pos)
+        self.pos = pos
+
+
+# ============================================================================
+def split_gzip_members(filename, split_size):
+    """Split a multi-member gzip WARC into byte ranges of approximately
+    split_size bytes, each starting at a gzip member which starts a new WARC
+    record, and which can be indexed independently of the previous range.
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    start = 0
+
+    with open(filename, "rb") as fh:
+        while start + split_size < size:
+            split = find_split_offset(fh, start + split_size, size)
+            if split is None:
+                break
+
+            ranges.append((start, split))
+            start = split
+
+    ranges.append((start, size))
+    return ranges
+
+
+def find_split_offset(fh, pos, size):
+    """Find the first safe split point at or after pos.
+
+    A candidate gzip member must decompress to a WARC record header. To avoid
+    separating a request/response pair (which buffering_record_iter joins),
+    the record at a split point must not be concurrent to the previous one.
+    """
+    while pos < size:
+        fh.seek(pos)
+        buff = fh.read(SCAN_SIZE)
+        if not buff:
+            break
+
+        i = buff.find(GZIP_MAGIC)
+        while i >= 0:
+            headers = read_member_headers(fh, pos + i)
+            if headers and is_safe_split(headers):
+                return pos + i
+
+            i = buff.find(GZIP_MAGIC, i + 1)
+
+        if len(buff) < SCAN_SIZE:
+            break
+
+        pos += len(buff) - len(GZIP_MAGIC) + 1
+
+    return None
+
+
+def read_member_headers(fh, offset):
+    """Decompress the start of the gzip member at offset and return its
+    WARC headers as a dict with lower-cased names, or None if the offset
+    does not start a gzip member containing a WARC record"""
+    fh.seek(offset)
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = b""
+
+    try:
+        while len(data) < MAX_HEADER_SIZE and not decomp.eof:
+            buff = fh.read(4096)
+            if not buff:
+                break
+
+            data += decomp.decompress(buff)
+            if not data.startswith(b"WARC/"[: len(data)]):
+                return None
+
+            if b"\r\n\r\n" in data:
+                break
+
+    except zlib.error:
+        return None
+
+    if not data.startswith(b"WARC/") or b"\r\n\r\n" not in data:
+        return None
+
+    headers = {}
+    for line in data.split(b"\r\n\r\n", 1)[0].split(b"\r\n")[1:]:
+        name, sep, value = line.partition(b":")
+        if not sep:
+            return None
+
+        headers[name.strip().lower().decode("latin-1")] = value.strip().decode(
+            "latin-1"
+        )
+
+    return headers
+
+
+def is_safe_split(headers):
+    if headers.get("warc-type") not in ("request", "response"):
+        return True
+
+    return "warc-concurrent-to" not in headers
@@ -0,0 +1,143 @@
+import json
+import sys
+import time
+
+
+# ============================================================================
+class IndexStats:
+    """Per-stage timing and counters for an indexing run.
+
+    Time is attributed to one stage at a time: entering a nested stage
+    pauses the enclosing one, so stage times are exclusive and add up to
+    the total. Only the indexing thread is timed; CPU time is process-wide,
+    so includes any background spill or compression threads.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.records = {}
+        self.counts = {
+            "lines": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "compressed_bytes": 0,
+            "spills": 0,
+            "duplicates": 0,
+        }
+
+        self.current = None
+        self.last_wall = None
+        self.last_cpu = None
+
+        self.start_wall = None
+        self.start_cpu = None
+        self.total_wall = 0.0
+        self.total_cpu = 0.0
+
+    def begin(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.switch("other")
+
+    def end(self):
+        self.switch(None)
+        self.total_wall += time.perf_counter() - self.start_wall
+        self.total_cpu += time.process_time() - self.start_cpu
+
+    def switch(self, stage):
+        """Make stage the current stage, and return the previous one"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        if self.current is not None:
+            entry = self.stages.get(self.current)
+            if not entry:
+                entry = self.stages[self.current] = [0.0, 0.0, 0]
+
+            entry[0] += wall - self.last_wall
+            entry[1] += cpu - self.last_cpu
+
+        prev = self.current
+        self.current = stage
+        self.last_wall = wall
+        self.last_cpu = cpu
+        return prev
+
+    def timed(self, stage, func):
+        """Wrap func to count its calls and time as stage"""
+
+        def timed_func(*args, **kwargs):
+            prev = self.switch(stage)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.switch(prev)
+                self.stages[stage][2] += 1
+
+        return timed_func
+
+    def iter_records(self, record_iter):
+        """Time reading records from record_iter, and count them by type"""
+        record_iter = iter(record_iter)
+
+        while True:
+            prev = self.switch("read")
+            try:
+                record = next(record_iter)
+            except StopIteration:
+                return
+            finally:
+                self.switch(prev)
+
+            self.records[record.rec_type] = self.records.get(record.rec_type, 0) + 1
+            yield record
+
+    def wrap_writer(self, writer):
+        """Time and count lines written to writer"""
+        write = self.timed("write", writer.write)
+
+        def counting_write(line):
+            self.counts["lines"] += 1
+            self.counts["bytes_out"] += len(line)
+            write(line)
+
+        writer.write = counting_write
+
+    def add_input(self, start, end):
+        if start is not None and end is not None:
+            self.counts["bytes_in"] += end - start
+
+    def to_dict(self):
+        stages = {}
+        for stage, (wall, cpu, calls) in sorted(self.stages.items()):
+            stages[stage] = {"wall": round(wall, 6), "cpu": round(cpu, 6)}
+            if calls:
+                stages[stage]["calls"] = calls
+
+        data = {
+            "total": {
+                "wall": round(self.total_wall, 6),
+                "cpu": round(self.total_cpu, 6),
+            },
+            "stages": stages,
+            "records": dict(sorted(self.records.items())),
+        }
+        data.update(self.counts)
+        return data
+
+    def write(self, output=None):
+        """Write stats as JSON to output filename, or to stderr"""
+        data = json.dumps(self.to_dict(), indent=2) + "\n"
+
+        if output and output != "-":
+            with open(output, "wt") as fh:
+                fh.write(data)
+        else:
+            sys.stderr.write(data)
+
+
+def get_pos(fh):
+    try:
+        return fh.tell()
+    except Exception:
+        return None
@@ -0,0 +1,53 @@
+import re
+
+# simple lower-case http(s) urls with a domain name host and a plain path,
+# for which SURT canonicalization only reverses the host
+RE_SIMPLE_URL = re.compile(
+    r"https?://((?:[a-z0-9-]+\.)+[a-z0-9-]*[a-z][a-z0-9-]*)((?:/[a-z0-9_~.-]*)*)\Z"
+)
+
+RE_WWW = re.compile(r"www\d*\Z")
+
+
+# ============================================================================
+def fast_surt(url):
+    """Compute the SURT urlkey of common simple urls without the full
+    canonicalization done by surt.surt(). Returns the same result as
+    surt.surt(url), or None if url is not a simple url.
+
+    >>> fast_surt("https://www.example.com/path/to/file.html")
+    'com,example)/path/to/file.html'
+
+    >>> fast_surt("http://Example.com")
+    'com,example)/'
+
+    >>> fast_surt("http://example.com/?a=b")
+    """
+    # lower() maps some non-ascii chars to ascii, eg. KELVIN SIGN to k
+    if not url or not url.isascii():
+        return None
+
+    url = url.lower()
+    m = RE_SIMPLE_URL.match(url)
+    if not m:
+        return None
+
+    host, path = m.groups()
+
+    # paths which are normalized
+    if "//" in path or "/./" in path or "/../" in path:
+        return None
+
+    if path.endswith(("/.", "/..")):
+        return None
+
+    labels = host.split(".")
+    if RE_WWW.match(labels[0]):
+        labels = labels[1:]
+
+    labels.reverse()
+
+    if len(path) > 1 and path.endswith("/"):
+        path = path[:-1]
+
+    return ",".join(labels) + ")" + (path or "/")
@@ -46,13 +46,17 @@ setup(
         "cdxj_indexer",
     ],
     install_requires=[
-        "warcio",
+        # skipping records uses private warcio reader state
+        "warcio>=1.7.4,<1.9",
         "surt",
         # temp fix for requests
         "idna<3.0",
         "py3amf",
         "multipart",
     ],
+    extras_require={
+        "fast-gzip": ["isal"],
+    },
     zip_safe=True,
     entry_points="""
         [console_scripts]
@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+from io import StringIO
+
+from cdxj_indexer.aio import index_stream, write_cdx_index_async
+from cdxj_indexer.main import write_cdx_index
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# ============================================================================
+def get_lines(filename, opts=None):
+    output = StringIO()
+    write_cdx_index(output, os.path.join(TEST_DIR, filename), dict(opts or {}))
+    return output.getvalue().rstrip("\n").split("\n")
+
+
+async def iter_chunks(filename, size=1000):
+    with open(os.path.join(TEST_DIR, filename), "rb") as fh:
+        while True:
+            buff = fh.read(size)
+            if not buff:
+                break
+
+            await asyncio.sleep(0)
+            yield buff
+
+
+async def collect(stream, filename, opts=None):
+    return [line async for line in index_stream(stream, filename, opts)]
+
+
+def get_stream_reader(filename):
+    stream = asyncio.StreamReader()
+    with open(os.path.join(TEST_DIR, filename), "rb") as fh:
+        stream.feed_data(fh.read())
+
+    stream.feed_eof()
+    return stream
+
+
+# ============================================================================
+def test_index_async_iterable():
+    res = asyncio.run(collect(iter_chunks("example.warc.gz"), "example.warc.gz"))
+    assert res == get_lines("example.warc.gz")
+
+
+def test_index_stream_reader():
+    opts = dict(post_append=True, sort=True)
+
+    async def run():
+        stream = get_stream_reader("post-test.warc.gz")
+        return await collect(stream, "post-test.warc.gz", opts)
+
+    assert asyncio.run(run()) == get_lines("post-test.warc.gz", opts)
+
+
+def test_index_concurrent():
+    filenames = ["example.warc.gz", "cc.warc.gz", "example.arc", "post-test.warc.gz"]
+
+    async def run():
+        return await asyncio.gather(
+            *[collect(iter_chunks(filename, 100), filename) for filename in filenames]
+        )
+
+    res = asyncio.run(run())
+    assert res == [get_lines(filename) for filename in filenames]
+
+
+def test_index_close_early():
+    async def run():
+        gen = index_stream(iter_chunks("cc.warc.gz", 10), "cc.warc.gz")
+        line = await gen.__anext__()
+        await gen.aclose()
+        return line
+
+    assert asyncio.run(run()) == get_lines("cc.warc.gz")[0]
+
+
+def test_write_cdx_index_async():
+    output = StringIO()
+    filename = os.path.join(TEST_DIR, "example.warc.gz")
+
+    asyncio.run(write_cdx_index_async(output, filename, {}))
+
+    assert output.getvalue().rstrip("\n").split("\n") == get_lines("example.warc.gz")
+
+
+def test_index_cancel_stalled_stream():
+    with open(os.path.join(TEST_DIR, "example.warc.gz"), "rb") as fh:
+        data = fh.read() * 100
+
+    async def stalled_stream():
+        yield data
+        await asyncio.Event().wait()
+
+    async def run():
+        gen = index_stream(stalled_stream(), "example.warc.gz")
+        line = await gen.__anext__()
+        await gen.aclose()
+        return line
+
+    assert asyncio.run(run()) == get_lines("example.warc.gz")[0]
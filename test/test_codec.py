@@ -0,0 +1,71 @@
+import json
+import os
+import zlib
+
+from io import BytesIO, StringIO
+
+import pytest
+
+from cdxj_indexer.codec import get_codec, get_codec_names
+from cdxj_indexer.main import write_cdx_index, CDXJIndexer
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+INPUTS = [
+    os.path.join(TEST_DIR, filename)
+    for filename in ("example.warc.gz", "post-test.warc.gz", "cc.warc.gz")
+]
+
+
+# ============================================================================
+@pytest.mark.parametrize("name", get_codec_names())
+def test_gzip_codec(name):
+    opts = dict(sort=True, post_append=True, skip_payload=False)
+
+    output = StringIO()
+    write_cdx_index(output, INPUTS, opts)
+
+    codec_output = StringIO()
+    write_cdx_index(codec_output, INPUTS, dict(opts, gzip_codec=name))
+
+    assert codec_output.getvalue() == output.getvalue()
+
+    # zipnum blocks are standard gzip members
+    index = StringIO()
+    data = BytesIO()
+    opts = dict(opts, compress=data, lines=3, gzip_codec=name)
+    write_cdx_index(index, INPUTS, opts)
+
+    lines = []
+    for line in index.getvalue().splitlines()[1:]:
+        block = json.loads(line.split(" ", 2)[2])
+        offset, length = block["offset"], block["length"]
+        lines.append(zlib.decompress(data.getvalue()[offset : offset + length], 31))
+
+    assert b"".join(lines).decode("utf-8") == output.getvalue()
+
+
+def test_gzip_codec_errors():
+    with pytest.raises(Exception):
+        get_codec("unknown")
+
+    assert get_codec("zlib") is zlib
+    assert get_codec("auto") is get_codec(get_codec_names()[0])
+
+
+def test_default_read_codec():
+    # isal, if installed, is the default codec for reading but not writing
+    isal_zlib = pytest.importorskip("isal.isal_zlib")
+
+    indexer = CDXJIndexer(None, INPUTS)
+    assert indexer.codec is isal_zlib
+    assert indexer.compress_codec is zlib
+
+    output = StringIO()
+    write_cdx_index(output, INPUTS, dict(post_append=True, skip_payload=False))
+
+    zlib_output = StringIO()
+    opts = dict(post_append=True, skip_payload=False, gzip_codec="zlib")
+    write_cdx_index(zlib_output, INPUTS, opts)
+
+    assert output.getvalue() == zlib_output.getvalue()
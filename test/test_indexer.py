@@ -1,4 +1,8 @@
+import json
 import os
+import random
+import shutil
+import zlib
 import sys
 import tempfile
 from io import BytesIO
@@ -8,9 +12,14 @@ try:
 except ImportError:  # pragma: no cover
     from io import StringIO
 
-from cdxj_indexer.main import write_cdx_index, main, CDXJIndexer
+from cdxj_indexer.main import write_cdx_index, main, CDXJIndexer, SortingWriter
+from cdxj_indexer.main import CompressedWriter, dumps_index, iter_file_or_dir
+from cdxj_indexer.splitter import split_gzip_members
+from cdxj_indexer.urlkey import fast_surt
 
 import pkg_resources
+import pytest
+import surt
 
 TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
 
@@ -70,6 +79,22 @@ com,example)/ 20170306040348 {"url": "http://example.com/", "mime": "warc/revisi
 """
         assert res == exp
 
+    def test_warc_cdxj_with_record_digests_unseekable(self):
+        class UnseekableReader:
+            def __init__(self, fh):
+                self.fh = fh
+
+            def read(self, size=-1):
+                return self.fh.read(size)
+
+        opts = dict(digest_records=True, post_append=True, filename="example.warc.gz")
+        with open(os.path.join(TEST_DIR, "example.warc.gz"), "rb") as fh:
+            output = StringIO()
+            write_cdx_index(output, UnseekableReader(fh), opts)
+
+        exp = self.index_file("example.warc.gz", digest_records=True, post_append=True)
+        assert output.getvalue() == exp
+
     def test_warc_cdxj_sorted(self):
         res = self.index_file("cc.warc.gz", sort=True)
         exp = """\
@@ -77,6 +102,12 @@ org,commoncrawl)/ 20170722005011 {"url": "https://commoncrawl.org/", "mime": "te
 """
         assert res == exp
 
+    def test_warc_cdxj_sorted_compressed_runs(self):
+        res = self.index_file(
+            "", sort=True, max_sort_buff_size=500, sort_compress_runs=True
+        )
+        assert res == self.index_file("", sort=True)
+
     def test_warc_cdxj_dir_root(self):
         res = self.index_file("example.warc.gz", dir_root="./")
         exp = """\
@@ -113,6 +144,150 @@ com,example)/ 20170306040348 http://example.com/ warc/revisit 200 G7HRM7BGOKSKMS
         res = self.index_all(["example.warc.gz", "post-test.warc.gz"])
         assert len(res.strip().split("\n")) == 5
 
+    def test_index_multiple_files_workers(self):
+        filenames = ["example.warc.gz", "post-test.warc.gz", "example.arc"]
+        res = self.index_all(filenames, workers=2, post_append=True)
+        assert res == self.index_all(filenames, post_append=True)
+
+        res = self.index_all(filenames, workers=2, sort=True, dir_root="./")
+        assert res == self.index_all(filenames, sort=True, dir_root="./")
+
+        res = self.index_file("", workers=3, cdx11=True, sort=True)
+        assert res == self.index_file("", cdx11=True, sort=True)
+
+    def test_index_split_file_workers(self):
+        for filename in ["example.warc.gz", "post-test.warc.gz", "cc.warc.gz"]:
+            for opts in [
+                dict(post_append=True, records="all"),
+                dict(digest_records=True, fields="req.http:method"),
+                dict(cdx11=True, sort=True),
+            ]:
+                res = self.index_file(filename, workers=2, split_size=100, **opts)
+                assert res == self.index_file(filename, **opts)
+
+    @pytest.mark.parametrize("cache", [False, True])
+    def test_index_workers_error(self, tmp_path, cache):
+        bad = tmp_path / "bad.warc.gz"
+        bad.write_bytes(b"not a warc")
+
+        inputs = [str(bad)]
+        for i in range(5):
+            inputs.append(str(tmp_path / "example-{0}.warc.gz".format(i)))
+            shutil.copy(os.path.join(TEST_DIR, "example.warc.gz"), inputs[-1])
+
+        run_dir = tmp_path / "runs"
+        run_dir.mkdir()
+
+        opts = dict(workers=2, sort=True, sort_tmp_dir=str(run_dir))
+        if cache:
+            opts["cache_dir"] = str(run_dir)
+
+        with pytest.raises(Exception):
+            write_cdx_index(StringIO(), inputs, opts)
+
+        runs = [name for name in os.listdir(str(run_dir)) if name.endswith(".cdxj")]
+        if not cache:
+            assert runs == []
+            return
+
+        # runs of indexed inputs are kept in the cache
+        with open(str(run_dir / "manifest.json")) as fh:
+            entries = json.load(fh)["files"]
+
+        assert str(bad) not in entries
+        assert sorted(runs) == sorted(
+            run for entry in entries.values() for run in entry["runs"]
+        )
+
+    def test_split_gzip_members(self):
+        path = os.path.join(TEST_DIR, "example.warc.gz")
+
+        # request/response pair at 784 and 2026 not split
+        assert split_gzip_members(path, 100) == [
+            (0, 353),
+            (353, 784),
+            (784, 2635),
+            (2635, 3829),
+        ]
+
+        assert split_gzip_members(path, 10000) == [(0, 3829)]
+
+    def test_index_cache_dir(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, "warcs")
+            cache_dir = os.path.join(temp_dir, "cache")
+            os.makedirs(input_dir)
+
+            for filename in ["example.warc.gz", "post-test.warc.gz", "cc.warc.gz"]:
+                shutil.copy(os.path.join(TEST_DIR, filename), input_dir)
+
+            for sort in [False, True]:
+                exp = self.index_all([input_dir], sort=sort)
+
+                res = self.index_all([input_dir], sort=sort, cache_dir=cache_dir)
+                assert res == exp
+
+                runs = set(os.listdir(cache_dir))
+                assert len(runs) == 4
+
+                # all runs reused
+                res = self.index_all([input_dir], sort=sort, cache_dir=cache_dir)
+                assert res == exp
+                assert set(os.listdir(cache_dir)) == runs
+
+            # one file changed, one removed
+            shutil.copy(
+                os.path.join(TEST_DIR, "example.warc.gz"),
+                os.path.join(input_dir, "cc.warc.gz"),
+            )
+            os.remove(os.path.join(input_dir, "post-test.warc.gz"))
+
+            exp = self.index_all([input_dir], sort=True)
+            res = self.index_all([input_dir], sort=True, cache_dir=cache_dir, workers=2)
+            assert res == exp
+
+            # manifest and example.warc.gz run kept
+            new_runs = set(os.listdir(cache_dir))
+            assert len(new_runs) == 3
+            assert len(new_runs & runs) == 2
+
+            # reused if only mtime changed, with content hash
+            res = self.index_all(
+                [input_dir], sort=True, cache_dir=cache_dir, cache_hash=True
+            )
+            runs = set(os.listdir(cache_dir))
+            os.utime(os.path.join(input_dir, "cc.warc.gz"))
+            res = self.index_all(
+                [input_dir], sort=True, cache_dir=cache_dir, cache_hash=True
+            )
+            assert res == exp
+            assert set(os.listdir(cache_dir)) == runs
+
+    def test_index_cache_dir_ignored_opts(self, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        filenames = ["example.warc.gz", "post-test.warc.gz", "example.arc"]
+
+        exp = self.index_all(filenames, post_append=True, cache_dir=cache_dir)
+        runs = set(os.listdir(cache_dir))
+
+        # options which don't change the output share cached runs
+        res = self.index_all(
+            filenames,
+            post_append=True,
+            cache_dir=cache_dir,
+            lazy_buffer=True,
+            mmap_input=False,
+            skip_payload=False,
+            gzip_codec="zlib",
+            urlkey_cache_size=0,
+            sort_compress_runs=True,
+        )
+        assert res == exp
+        assert set(os.listdir(cache_dir)) == runs
+
+        self.index_all(filenames, cache_dir=cache_dir)
+        assert not set(os.listdir(cache_dir)) & runs - {"manifest.json"}
+
     def test_warc_request_only(self):
         res = self.index_file("example.warc.gz", records="request", fields="method")
         exp = """\
@@ -179,6 +354,15 @@ org,httpbin)/post?__wb_method=post&__wb_post_data=c29tzwnodw5rlwvuy29kzwrkyxrh 2
 """
         assert res == exp
 
+    def test_warc_lazy_buffer(self):
+        for filename in ["post-test.warc.gz", "post-test-more.warc", "example.warc.gz"]:
+            for opts in [
+                dict(post_append=True),
+                dict(fields="req.http:referer,req.http:method", records="all"),
+            ]:
+                res = self.index_file(filename, lazy_buffer=True, **opts)
+                assert res == self.index_file(filename, **opts)
+
     def test_warc_cdxj_compressed_1(self):
         # specify file directly
         with tempfile.TemporaryFile() as temp_fh:
@@ -272,6 +456,84 @@ org,httpbin)/post?__wb_method=post&another=more^data&test=some+data 202008091953
 
         assert res3 == res.replace("comp_2.cdxj.gz", name)
 
+    def test_warc_cdxj_compressed_threads(self):
+        results = []
+        for threads in [None, 3]:
+            with tempfile.TemporaryFile() as temp_fh:
+                res = self.index_file(
+                    "",
+                    sort=True,
+                    compress=temp_fh,
+                    data_out_name="comp.cdxj.gz",
+                    lines=2,
+                    digest_records=True,
+                    compress_threads=threads,
+                )
+                temp_fh.seek(0)
+                results.append((res, temp_fh.read()))
+
+        assert len(results[0][0].split("\n")) > 8
+        assert results[0] == results[1]
+
+    def test_warc_cdxj_compressed_block_bytes(self):
+        with tempfile.TemporaryFile() as temp_fh:
+            res = self.index_file(
+                "",
+                sort=True,
+                compress=temp_fh,
+                data_out_name="comp.cdxj.gz",
+                block_bytes=1000,
+            )
+            temp_fh.seek(0)
+            data = temp_fh.read()
+
+        blocks = [
+            json.loads("{" + line.split(" {", 1)[1])
+            for line in res.strip().split("\n")[1:]
+        ]
+
+        assert len(blocks) > 2
+        sizes = [
+            len(zlib.decompress(data[b["offset"] : b["offset"] + b["length"]], 31))
+            for b in blocks
+        ]
+
+        assert all(size >= 1000 for size in sizes[:-1])
+        assert max(sizes) < 2000
+
+    @pytest.mark.parametrize("threads", [None, 4])
+    def test_compressed_block_bytes_compressed(self, threads):
+        rng = random.Random(0)
+        data = BytesIO()
+        index = BytesIO()
+        writer = CompressedWriter(
+            index,
+            data,
+            threads=threads,
+            block_bytes=2000,
+            block_bytes_compressed=True,
+        )
+
+        for i in range(5000):
+            digest = "".join(
+                rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ234567") for _ in range(32)
+            )
+            line = 'com,example)/{0} 20200101000000 {{"digest": "{1}"}}\n'.format(
+                i, digest
+            )
+            writer.write(line.encode("utf-8"))
+
+        writer.flush()
+
+        lengths = [
+            json.loads(b"{" + line.split(b" {", 1)[1])["length"]
+            for line in index.getvalue().splitlines()[1:]
+        ]
+
+        # first block is sized before the compression ratio is known
+        assert len(lengths) > 20
+        assert all(1600 < length < 2400 for length in lengths[1:-1])
+
     def test_warc_index_add_custom_fields(self):
         res = self.index_file("example.warc.gz", fields="method,referrer,http:date")
 
@@ -352,6 +614,106 @@ com,zoubanio,img1)/icon/u3927203-87.jpg 20170430113919 {"url": "https://img1.zou
         assert res == exp
 
 
+def test_sorting_writer_cascade_merge():
+    lines = ["line-{0} \u00e9\n".format(i % 37) for i in range(200)]
+    lines += ["line-\U0001f600\n", "line-\uffff\n", "line-z\n"]
+
+    output = StringIO()
+    writer = SortingWriter(output, max_sort_buff_size=50, max_fan_in=3)
+    for line in lines:
+        writer.write(line)
+
+    writer.flush()
+
+    assert not writer.tmp_files
+    assert output.getvalue() == "".join(sorted(set(lines)))
+
+
+def test_sorting_writer_compressed_runs():
+    lines = ["line-{0}\n".format(i % 53) for i in range(500)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = StringIO()
+        writer = SortingWriter(
+            output, max_sort_buff_size=100, compress_runs=True, tmp_dir=tmp_dir
+        )
+        for line in lines:
+            writer.write(line)
+
+        writer.wait_pending()
+        assert all(name.startswith(tmp_dir) for name in writer.tmp_files)
+        assert all(name.endswith(".cdxj.gz") for name in writer.tmp_files)
+
+        writer.flush()
+        assert output.getvalue() == "".join(sorted(set(lines)))
+        assert os.listdir(tmp_dir) == []
+
+        writer = SortingWriter(
+            StringIO(), max_sort_buff_size=100, tmp_dir=tmp_dir, max_scratch_size=1000
+        )
+        with pytest.raises(Exception):
+            for line in lines:
+                writer.write(line)
+
+            writer.flush()
+
+        assert os.listdir(tmp_dir) == []
+
+        # scratch size exceeded by an intermediate run of a cascade merge
+        writer = SortingWriter(
+            BytesIO(),
+            max_sort_buff_size=100,
+            max_fan_in=2,
+            tmp_dir=tmp_dir,
+            max_scratch_size=1400,
+        )
+        for i in range(120):
+            writer.write("line-{0:03d}\n".format(i).encode("utf-8"))
+
+        with pytest.raises(Exception):
+            writer.flush()
+
+        assert os.listdir(tmp_dir) == []
+
+
+def test_fast_surt_matches_surt():
+    labels = ["www", "www2", "wwwx", "a", "Example", "1", "0-x", "xn--bcher-kva"]
+    segments = ["a", "b.html", "~u", "x_y", "a.", "..", ".", "", "-", "A%20", "?a=b"]
+
+    rng = random.Random(0)
+    count = 0
+    for i in range(5000):
+        host = ".".join(rng.choice(labels) for _ in range(rng.randint(1, 4)))
+        path = "".join("/" + rng.choice(segments) for _ in range(rng.randint(0, 3)))
+        url = rng.choice(["http://", "https://", "ftp://"]) + host + path
+
+        urlkey = fast_surt(url)
+        if urlkey:
+            count += 1
+            assert urlkey == surt.surt(url), url
+
+    assert count > 1000
+
+    for url in ["http://example.com/\u212a", "http://\u212a.example.com/"]:
+        assert fast_surt(url) is None
+        assert CDXJIndexer(None, []).get_url_key(url) == surt.surt(url)
+
+
+def test_urlkey_cache():
+    indexer = CDXJIndexer(StringIO(), os.path.join(TEST_DIR, "example.warc.gz"))
+    indexer.process_all()
+
+    assert indexer.get_urlkey_stats() == {"hits": 1, "misses": 1, "fast": 1}
+
+    indexer = CDXJIndexer(
+        StringIO(), os.path.join(TEST_DIR, "post-test.warc.gz"), urlkey_cache_size=0
+    )
+    indexer.process_all()
+
+    assert indexer.get_urlkey_stats() == {"hits": 0, "misses": 0, "fast": 2}
+    assert indexer.get_url_key("http://example.com/?B=1&a=2") == "com,example)/?a=2&b=1"
+
+
 class CustomIndexer(CDXJIndexer):
     def process_index_entry(self, it, record, *args):
         type_ = record.rec_headers.get("WARC-Type")
@@ -372,3 +734,208 @@ def test_custom_indexer():
     assert indexer.collect_records
 
     indexer.process_all()
+
+
+class LazyBufferIndexer(CDXJIndexer):
+    def process_index_entry(self, it, record, *args):
+        if record.rec_type == "request":
+            record.buffered_stream.seek(0)
+            assert record.buffered_stream.read() != b""
+        else:
+            assert record.buffered_stream is None
+
+
+def test_lazy_buffer_indexer():
+    indexer = LazyBufferIndexer(
+        output=StringIO(),
+        inputs=[os.path.join(TEST_DIR, "post-test.warc.gz")],
+        records="all",
+        post_append=True,
+        lazy_buffer=True,
+    )
+
+    indexer.process_all()
+
+
+def test_dumps_index_matches_json():
+    chars = ["a", "/", '"', "\\", "\n", "\x00", "\x7f", "é", " ", "😀", " "]
+
+    rng = random.Random(0)
+    for i in range(2000):
+        index = {}
+        for j in range(rng.randint(0, 6)):
+            key = "".join(rng.choice(chars) for _ in range(rng.randint(0, 3)))
+            index[key] = "".join(rng.choice(chars) for _ in range(rng.randint(0, 8)))
+
+        assert dumps_index(index) == json.dumps(index)
+
+    index = {"url": "http://example.com/", "length": 100, "offset": None}
+    assert dumps_index(index) == json.dumps(index)
+
+
+@pytest.mark.parametrize("sort", [False, True])
+def test_binary_output(sort):
+    output = StringIO()
+    write_cdx_index(output, TEST_DIR, dict(sort=sort, post_append=True))
+
+    bin_output = BytesIO()
+    write_cdx_index(bin_output, TEST_DIR, dict(sort=sort, post_append=True))
+
+    assert bin_output.getvalue() == output.getvalue().encode("utf-8")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "index.cdxj")
+        write_cdx_index(path, TEST_DIR, dict(sort=sort, post_append=True))
+
+        with open(path, "rb") as fh:
+            assert fh.read() == bin_output.getvalue()
+
+
+def test_stats():
+    filename = os.path.join(TEST_DIR, "post-test.warc.gz")
+
+    output = StringIO()
+    write_cdx_index(output, filename, dict(sort=True, post_append=True))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stats_output = os.path.join(tmp_dir, "stats.json")
+        stats_index = StringIO()
+        indexer = write_cdx_index(
+            stats_index,
+            filename,
+            dict(sort=True, post_append=True, stats_output=stats_output),
+        )
+
+        with open(stats_output, "rt") as fh:
+            stats = json.load(fh)
+
+    assert stats_index.getvalue() == output.getvalue()
+    assert stats == indexer.stats.to_dict()
+
+    assert stats["records"] == {"request": 3, "response": 3}
+    assert stats["lines"] == 3
+    assert stats["bytes_out"] == len(output.getvalue())
+    assert stats["bytes_in"] == os.path.getsize(filename)
+    assert stats["spills"] == 0
+
+    stages = stats["stages"]
+    assert set(stages) == {
+        "buffer",
+        "index",
+        "other",
+        "read",
+        "serialize",
+        "sort",
+        "urlkey",
+        "write",
+    }
+    assert stages["index"]["calls"] == 3
+
+    total = sum(stage["wall"] for stage in stages.values())
+    assert abs(total - stats["total"]["wall"]) < 0.01
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_progress_callback(workers):
+    events = []
+
+    output = StringIO()
+    write_cdx_index(
+        output,
+        TEST_DIR,
+        dict(workers=workers, progress_callback=events.append, progress_interval=0),
+    )
+
+    num_files = len(list(iter_file_or_dir([TEST_DIR])))
+    total = sum(map(os.path.getsize, iter_file_or_dir([TEST_DIR])))
+
+    assert [event["event"] for event in events] == ["file"] * num_files + ["done"]
+    assert [event["files_done"] for event in events[:-1]] == list(
+        range(1, num_files + 1)
+    )
+
+    done = events[-1]
+    assert done["files_done"] == done["files_total"] == num_files
+    assert done["bytes_done"] == done["bytes_total"] == total
+    assert done["eta"] == 0
+    if not workers:
+        assert done["records"] == 29
+
+
+@pytest.mark.parametrize("sort", [False, True])
+def test_iter_entries(sort):
+    output = StringIO()
+    write_cdx_index(output, TEST_DIR, dict(sort=sort, post_append=True))
+
+    indexer = CDXJIndexer(None, TEST_DIR, post_append=True)
+    entries = list(indexer.iter_entries(sort=sort, dedup=sort))
+
+    lines = [
+        urlkey + " " + ts + " " + json.dumps(index) for urlkey, ts, index in entries
+    ]
+    assert lines == output.getvalue().rstrip("\n").split("\n")
+
+
+def test_iter_entries_lazy():
+    inputs = []
+    for name in ("example.warc.gz", "cc.warc.gz"):
+        with open(os.path.join(TEST_DIR, name), "rb") as fh:
+            inputs.append(BytesIO(fh.read()))
+
+    entries = CDXJIndexer(None, inputs, filename="test.warc.gz").iter_entries()
+
+    urlkey, ts, index = next(entries)
+    assert (urlkey, ts) == ("com,example)/", "20170306040206")
+    assert index["filename"] == "test.warc.gz"
+    assert inputs[1].tell() == 0
+
+    assert len(list(entries)) == 2
+
+
+@pytest.mark.parametrize(
+    "opts",
+    [
+        {},
+        {"sort": True},
+        {"workers": 2},
+        {"cdx11": True},
+        {"post_append": True, "sort": True, "max_sort_buff_size": 500},
+    ],
+)
+def test_dedup_copies(opts, tmp_path):
+    inputs = {"a": [], "b": []}
+    for dirname in inputs:
+        os.makedirs(str(tmp_path / dirname))
+        for name in ("example.warc.gz", "post-test.warc.gz", "cc.warc.gz"):
+            shutil.copy(os.path.join(TEST_DIR, name), str(tmp_path / dirname))
+            inputs[dirname].append(str(tmp_path / dirname / name))
+
+    opts = dict(opts, dir_root=str(tmp_path))
+
+    def index(inputs, opts):
+        output = StringIO()
+        write_cdx_index(output, inputs, opts)
+        # cdx header is written per file
+        return [line for line in output.getvalue().split("\n") if line[:4] != " CDX"]
+
+    expected = index(inputs["a"], opts)
+
+    assert index(inputs["a"] + inputs["b"], dict(opts, dedup=True)) == expected
+
+    # only the hash of the last line is kept: unsorted, copies are not found,
+    # sorted, copies are adjacent
+    output = index(inputs["a"] + inputs["b"], dict(opts, dedup=True, dedup_max_keys=1))
+
+    if opts.get("sort"):
+        assert output == expected
+    else:
+        assert len(output) > len(expected)
+
+
+def test_dedup_stats(tmp_path):
+    stats_output = str(tmp_path / "stats.json")
+    opts = dict(dedup=True, stats_output=stats_output)
+    write_cdx_index(StringIO(), [os.path.join(TEST_DIR, "example.warc.gz")] * 3, opts)
+
+    with open(stats_output, "rt") as fh:
+        assert json.load(fh)["duplicates"] == 4
@@ -0,0 +1,126 @@
+import os
+import tempfile
+
+from io import StringIO
+
+import pytest
+
+from cdxj_indexer.main import write_cdx_index, main
+from cdxj_indexer.merge import merge_indexes
+from cdxj_indexer.reader import CDXJReader
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+FILES_1 = ["example.warc.gz", "post-test-more.warc", "bad.arc"]
+FILES_2 = ["post-test.warc.gz", "cc.warc.gz", "example.arc", "missing-http.warc.gz"]
+
+
+# ============================================================================
+class TestMerge(object):
+    def setup_method(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def teardown_method(self):
+        self.temp_dir.cleanup()
+
+    def index(self, name, filenames, **opts):
+        path = os.path.join(self.temp_dir.name, name)
+        paths = [os.path.join(TEST_DIR, filename) for filename in filenames]
+        write_cdx_index(path, paths, dict(sort=True, post_append=True, **opts))
+        return path
+
+    def read(self, path):
+        with open(path, "rt") as fh:
+            return fh.read()
+
+    def merge(self, inputs, **opts):
+        output = StringIO()
+        merge_indexes(output, inputs, **opts)
+        return output.getvalue()
+
+    def test_merge_cdxj(self):
+        exp = self.read(self.index("all.cdxj", FILES_1 + FILES_2))
+
+        index_1 = self.index("index_1.cdxj", FILES_1)
+        index_2 = self.index("index_2.cdxj", FILES_2)
+
+        assert self.merge([index_1, index_2]) == exp
+        assert self.merge([index_1, index_2, index_1], max_fan_in=2) == exp
+
+        res = self.merge([index_1, index_1], dedup=False)
+        assert res.split("\n")[:2] == [self.read(index_1).split("\n")[0]] * 2
+
+    def test_merge_no_final_newline(self):
+        inputs = []
+        for name, text in [
+            ("m1.cdxj", "a 1 {}\nc 1 {}"),
+            ("m2.cdxj", "b 1 {}\nd 1 {}\n"),
+            ("m3.cdxj", "e 1 {}"),
+        ]:
+            inputs.append(os.path.join(self.temp_dir.name, name))
+            with open(inputs[-1], "wt") as fh:
+                fh.write(text)
+
+        assert self.merge(inputs) == "a 1 {}\nb 1 {}\nc 1 {}\nd 1 {}\ne 1 {}\n"
+
+    def test_merge_cdx11(self):
+        exp = self.read(self.index("all.cdx", FILES_1 + FILES_2, cdx11=True))
+        assert exp.startswith(" CDX N b a m s k r M S V g\n")
+
+        index_1 = self.index("index_1.cdx", FILES_1, cdx11=True)
+        index_2 = self.index("index_2.cdx", FILES_2, cdx11=True)
+
+        assert self.merge([index_1, index_2]) == exp
+
+    def test_merge_mixed_formats(self):
+        cdxj = self.index("index.cdxj", FILES_1)
+        cdx11 = self.index("index.cdx11", FILES_2, cdx11=True)
+        cdx09 = self.index("index.cdx09", FILES_2, cdx09=True)
+
+        for inputs in ([cdxj, cdx11], [cdx11, cdx09], [cdx09, cdxj]):
+            with pytest.raises(ValueError):
+                self.merge(inputs)
+
+        zipnum = self.index(
+            "zipnum.cdxj", FILES_2, compress=os.path.join(self.temp_dir.name, "z.gz")
+        )
+        with pytest.raises(ValueError):
+            self.merge([cdx11, zipnum])
+
+        assert self.merge([cdxj, zipnum]) == self.merge(
+            [cdxj, self.index("all.cdxj", FILES_2)]
+        )
+
+    def test_merge_zipnum_to_zipnum(self):
+        exp = self.read(self.index("all.cdxj", FILES_1 + FILES_2))
+
+        zipnum_1 = self.index(
+            "zipnum_1.cdxj",
+            FILES_1,
+            compress=os.path.join(self.temp_dir.name, "zipnum_1.cdxj.gz"),
+            lines=2,
+        )
+        index_2 = self.index("index_2.cdxj", FILES_2)
+
+        assert self.merge([zipnum_1, index_2]) == exp
+
+        output = os.path.join(self.temp_dir.name, "merged.cdxj")
+        main(
+            [
+                "merge",
+                "-o",
+                output,
+                "-c",
+                os.path.join(self.temp_dir.name, "merged.cdxj.gz"),
+                "-l",
+                "4",
+                zipnum_1,
+                index_2,
+            ]
+        )
+
+        with CDXJReader(output) as reader:
+            assert len(reader.blocks) == 4
+            res = [line.decode("utf-8") + "\n" for line in reader.iter_lines()]
+
+        assert "".join(res) == exp
@@ -0,0 +1,70 @@
+import gzip
+import os
+
+from io import BytesIO, StringIO
+
+import pytest
+
+from cdxj_indexer.main import write_cdx_index
+from cdxj_indexer.mmapreader import MmapReader, open_mmap
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# ============================================================================
+@pytest.fixture
+def post_warc(tmp_path):
+    # test WARCs with POST requests are gzipped
+    filename = str(tmp_path / "post-test.warc")
+    with open(filename, "wb") as fh:
+        for name in ("post-test.warc.gz", "post-test-more.warc"):
+            with gzip.open(os.path.join(TEST_DIR, name), "rb") as fh_in:
+                fh.write(fh_in.read())
+
+    return filename
+
+
+def test_open_mmap(post_warc):
+    with open(post_warc, "rb") as fh:
+        reader = open_mmap(fh)
+        assert isinstance(reader, MmapReader)
+
+        assert reader.read(8) == b"WARC/1.0"
+        assert reader.seek(-8, os.SEEK_END) == os.path.getsize(fh.name) - 8
+        assert len(reader.read()) == 8
+        assert reader.read() == b""
+
+        reader.close()
+        assert fh.tell() == os.path.getsize(fh.name)
+
+    with open(os.path.join(TEST_DIR, "post-test-more.warc"), "rb") as fh:
+        assert open_mmap(fh) is None
+
+    assert open_mmap(BytesIO(b"WARC/1.0\r\n")) is None
+
+
+@pytest.mark.parametrize(
+    "opts",
+    [
+        {},
+        {"post_append": True},
+        {"post_append": True, "lazy_buffer": False},
+        {"digest_records": True, "post_append": True},
+        {"digest_records": True, "skip_payload": False},
+    ],
+)
+@pytest.mark.parametrize("filename", ["post-test.warc", "example.arc"])
+def test_mmap_input(filename, opts, post_warc):
+    if filename == "post-test.warc":
+        input_ = post_warc
+    else:
+        input_ = os.path.join(TEST_DIR, filename)
+
+    output = StringIO()
+    write_cdx_index(output, input_, opts)
+
+    full_output = StringIO()
+    write_cdx_index(full_output, input_, dict(opts, mmap_input=False))
+
+    assert output.getvalue() == full_output.getvalue()
+    assert output.getvalue()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+
+import pytest
+
+from cdxj_indexer.main import write_cdx_index
+from cdxj_indexer.reader import CDXJReader
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# ============================================================================
+class TestReader(object):
+    @classmethod
+    def setup_class(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+
+        cls.cdxj = os.path.join(cls.temp_dir.name, "index.cdxj")
+        write_cdx_index(cls.cdxj, TEST_DIR, dict(sort=True, post_append=True))
+
+        with open(cls.cdxj, "rt") as fh:
+            cls.lines = fh.read().rstrip().split("\n")
+
+        cls.zipnum = os.path.join(cls.temp_dir.name, "zipnum.cdxj")
+        write_cdx_index(
+            cls.zipnum,
+            TEST_DIR,
+            dict(
+                sort=True,
+                post_append=True,
+                compress=os.path.join(cls.temp_dir.name, "zipnum.cdxj.gz"),
+                lines=3,
+            ),
+        )
+
+    @classmethod
+    def teardown_class(cls):
+        cls.temp_dir.cleanup()
+
+    def filter_lines(self, func):
+        return [line for line in self.lines if func(line)]
+
+    @pytest.mark.parametrize("index", ["cdxj", "zipnum"])
+    def test_lookup_exact(self, index):
+        with CDXJReader(getattr(self, index)) as reader:
+            res = list(reader.lookup("com,example)/"))
+            assert len(res) == 6
+            assert res == self.filter_lines(
+                lambda line: line.startswith("com,example)/ ")
+            )
+
+            res = list(reader.lookup("com,example)/", from_ts="2017"))
+            assert len(res) == 2
+            assert all(" 2017" in line for line in res)
+
+            res = list(reader.lookup("com,example)/", from_ts="2014", to_ts="2014"))
+            assert len(res) == 4
+
+            res = list(reader.lookup("com,example)/", to_ts="20140216050221"))
+            assert len(res) == 2
+
+            assert list(reader.lookup("com,example)/foo")) == []
+            assert list(reader.lookup("zzz")) == []
+            assert list(reader.lookup("")) == []
+
+    @pytest.mark.parametrize("index", ["cdxj", "zipnum"])
+    def test_lookup_prefix_and_range(self, index):
+        with CDXJReader(getattr(self, index)) as reader:
+            res = list(reader.lookup("org,httpbin)/post", match="prefix"))
+            assert len(res) == 6
+            assert res == self.filter_lines(
+                lambda line: line.startswith("org,httpbin)/post")
+            )
+
+            res = list(reader.lookup("org,", match="prefix", to_ts="2017"))
+            assert res == self.filter_lines(
+                lambda line: line.startswith("org,") and " 2020" not in line
+            )
+
+            assert list(reader.lookup("", match="prefix")) == self.lines
+
+            res = list(reader.range("com,example)/", "org,commoncrawl)/"))
+            assert res == self.filter_lines(
+                lambda line: "com,example)/" <= line < "org,commoncrawl)/"
+            )
+
+            assert list(reader.range("org,httpbin)/post?")) == self.lines[-6:]
+
+        with pytest.raises(ValueError):
+            CDXJReader(self.cdxj).lookup("com,", match="other")
+
+    def test_zipnum_reads_only_needed_blocks(self):
+        with CDXJReader(self.zipnum) as reader:
+            assert len(reader.blocks) == 5
+
+            read_blocks = []
+            iter_blocks = reader._iter_blocks
+
+            def _iter_blocks(index):
+                read_blocks.append(index)
+                return iter_blocks(index)
+
+            reader._iter_blocks = _iter_blocks
+            assert len(list(reader.lookup("org,commoncrawl)/"))) == 1
+            assert read_blocks == [2]
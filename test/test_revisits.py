@@ -0,0 +1,93 @@
+import json
+import os
+
+from io import StringIO
+
+import pytest
+
+from cdxj_indexer.main import write_cdx_index, CDXJIndexer
+from cdxj_indexer.revisits import DigestMap
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# ============================================================================
+def test_digest_map(tmp_path):
+    digests = DigestMap(max_size=3, tmp_dir=str(tmp_path))
+
+    for i in range(10):
+        digests.add("sha1:{0}".format(i % 7), ("url-{0}".format(i), str(i)))
+
+    assert digests.num_spills == 3
+    assert digests.get("sha1:1") == ("url-1", "1")
+    assert digests.get("sha1:6") == ("url-6", "6")
+    assert digests.get("sha1:missing") is None
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    digests.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize(
+    "opts",
+    [{}, {"sort": True}, {"workers": 2}, {"revisit_map_size": 1}],
+)
+def test_resolve_revisits(opts):
+    inputs = [
+        os.path.join(TEST_DIR, name) for name in ("cc.warc.gz", "example.warc.gz")
+    ]
+
+    output = StringIO()
+    write_cdx_index(output, inputs, dict(opts, resolve_revisits=True))
+
+    revisits = []
+    for line in output.getvalue().splitlines():
+        index = json.loads(line.split(" ", 2)[2])
+        if index["mime"] == "warc/revisit":
+            revisits.append(index)
+        else:
+            assert "orig.url" not in index
+
+    assert len(revisits) == 1
+    assert revisits[0]["orig.url"] == "http://example.com/"
+    assert revisits[0]["orig.timestamp"] == "20170306040206"
+    assert revisits[0]["orig.filename"] == "example.warc.gz"
+    assert revisits[0]["orig.offset"] == "784"
+    assert revisits[0]["orig.length"] == "1242"
+
+
+def test_resolve_revisits_original_not_indexed():
+    # originals are only found if indexed before the revisit
+    output = StringIO()
+    opts = dict(resolve_revisits=True, records="revisit")
+    write_cdx_index(output, os.path.join(TEST_DIR, "example.warc.gz"), opts)
+
+    assert "warc/revisit" in output.getvalue()
+    assert "orig." not in output.getvalue()
+
+
+@pytest.mark.parametrize("opt", ["cdx11", "cdx09"])
+def test_resolve_revisits_cdx(opt):
+    inputs = os.path.join(TEST_DIR, "example.warc.gz")
+    with pytest.raises(ValueError):
+        write_cdx_index(StringIO(), inputs, {opt: True, "resolve_revisits": True})
+
+
+def test_resolve_revisits_error_cleanup(tmp_path):
+    # digests spilled to disk are removed if indexing fails
+    bad = tmp_path / "bad.warc.gz"
+    bad.write_bytes(b"not a warc")
+
+    inputs = [os.path.join(TEST_DIR, "example.warc.gz"), str(bad)]
+    opts = dict(resolve_revisits=True, revisit_map_size=1, sort_tmp_dir=str(tmp_path))
+
+    with pytest.raises(Exception):
+        write_cdx_index(StringIO(), inputs, opts)
+
+    assert os.listdir(str(tmp_path)) == ["bad.warc.gz"]
+
+    entries = CDXJIndexer(None, inputs, **opts).iter_entries()
+    with pytest.raises(Exception):
+        list(entries)
+
+    assert os.listdir(str(tmp_path)) == ["bad.warc.gz"]
@@ -0,0 +1,116 @@
+import os
+import tempfile
+
+from io import StringIO
+
+from cdxj_indexer.main import write_cdx_index, main
+from cdxj_indexer.segments import SegmentedIndex
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+FILES = [
+    "example.warc.gz",
+    "post-test-more.warc",
+    "bad.arc",
+    "post-test.warc.gz",
+    "cc.warc.gz",
+    "example.arc",
+]
+
+
+# ============================================================================
+class TestSegments(object):
+    def setup_method(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "segments")
+
+    def teardown_method(self):
+        self.temp_dir.cleanup()
+
+    def get_lines(self, filenames):
+        output = StringIO()
+        paths = [os.path.join(TEST_DIR, filename) for filename in filenames]
+        write_cdx_index(output, paths, dict(sort=True))
+        return output.getvalue().rstrip().split("\n")
+
+    def test_add_lookup_compact(self):
+        index = SegmentedIndex(self.path, max_segments=3, lines=2)
+
+        for filename in FILES[:3]:
+            index.add_segment([os.path.join(TEST_DIR, filename)])
+            assert not index.needs_compaction()
+
+        exp = self.get_lines(FILES[:3])
+        assert list(index.lookup("", match="prefix")) == exp
+
+        index.add_segment([os.path.join(TEST_DIR, FILES[3])])
+        assert len(index.get_segments()) == 4
+        assert index.needs_compaction()
+
+        res = list(index.lookup("com,example)/"))
+        assert len(res) == 5
+
+        index.compact(background=True).join()
+
+        assert len(index.get_segments()) == 1
+        assert not index.needs_compaction()
+        assert len(os.listdir(self.path)) == 3
+
+        exp = self.get_lines(FILES[:4])
+        assert list(index.lookup("", match="prefix")) == exp
+        assert list(index.lookup("com,example)/")) == res
+
+        index.close()
+
+    def test_lookup_during_compaction(self):
+        index = SegmentedIndex(self.path, lines=2)
+        for filename in FILES[:3]:
+            index.add_segment([os.path.join(TEST_DIR, filename)])
+
+        exp = list(index.lookup("com,", match="prefix"))
+        assert len(exp) > 1
+
+        lookup = index.lookup("com,", match="prefix")
+        res = [next(lookup)]
+
+        index.compact(background=True).join()
+        assert len(index.get_segments()) == 1
+
+        # compacted segments are kept until the running lookup is done
+        assert len(os.listdir(self.path)) == 9
+
+        res.extend(lookup)
+        assert res == exp
+        assert len(os.listdir(self.path)) == 3
+
+        assert list(index.lookup("com,", match="prefix")) == exp
+        index.close()
+
+    def test_compact_size(self):
+        index = SegmentedIndex(self.path, compact_size=100)
+        index.add_segment([os.path.join(TEST_DIR, FILES[0])])
+        assert not index.needs_compaction()
+
+        index.add_segment([os.path.join(TEST_DIR, FILES[1])])
+        assert index.needs_compaction()
+
+    def test_segments_cli(self, capsys):
+        for filename in FILES:
+            main(
+                [
+                    "segments",
+                    "add",
+                    self.path,
+                    os.path.join(TEST_DIR, filename),
+                    "--max-segments",
+                    "4",
+                ]
+            )
+
+        assert len(SegmentedIndex(self.path).get_segments()) == 2
+
+        main(["segments", "compact", self.path, "--force"])
+        assert len(SegmentedIndex(self.path).get_segments()) == 1
+
+        main(["segments", "lookup", self.path, "", "--match", "prefix"])
+        assert capsys.readouterr().out.rstrip().split("\n") == self.get_lines(FILES)
@@ -0,0 +1,120 @@
+import gzip
+import os
+import random
+
+from io import BytesIO, StringIO
+
+import pytest
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from cdxj_indexer.main import write_cdx_index
+from cdxj_indexer.skipiter import SkippingArchiveIterator, READER_STATE
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# ============================================================================
+def write_warc(filename, use_gzip):
+    rng = random.Random(0)
+
+    # a gzip member containing a WARC record, embedded in a payload
+    fake_member = gzip.compress(b"WARC/1.0\r\nWARC-Type: response\r\n\r\n")
+
+    with open(filename, "wb") as fh:
+        writer = WARCWriter(fh, gzip=use_gzip)
+        for i in range(6):
+            size = [100, 200000, 70000, 5000, 300000, 90000][i]
+            half = rng.getrandbits(size // 2 * 8).to_bytes(size // 2, "little")
+            payload = half + fake_member + half
+
+            http_headers = StatusAndHeaders(
+                "200 OK",
+                [("Content-Type", "image/jpeg"), ("Content-Length", str(len(payload)))],
+                protocol="HTTP/1.0",
+            )
+            record = writer.create_warc_record(
+                "http://example.com/{0}.jpg".format(i),
+                "response",
+                payload=BytesIO(payload),
+                http_headers=http_headers,
+            )
+            writer.write_record(record)
+
+
+def get_offsets(filename, cls):
+    with open(filename, "rb") as fh:
+        it = cls(fh, arc2warc=True)
+        offsets = [
+            (rec.rec_type, it.get_record_offset(), it.get_record_length()) for rec in it
+        ]
+
+    return offsets, getattr(it, "skipped", 0)
+
+
+@pytest.mark.parametrize("use_gzip", [True, False])
+def test_skip_payload(use_gzip, tmp_path):
+    filename = str(tmp_path / ("test.warc.gz" if use_gzip else "test.warc"))
+    write_warc(filename, use_gzip)
+
+    offsets, skipped = get_offsets(filename, SkippingArchiveIterator)
+    assert offsets == get_offsets(filename, ArchiveIterator)[0]
+    assert len(offsets) == 6
+    assert skipped > 500000
+
+    output = StringIO()
+    write_cdx_index(output, filename, {})
+
+    full_output = StringIO()
+    write_cdx_index(full_output, filename, dict(skip_payload=False))
+
+    assert output.getvalue() == full_output.getvalue()
+    assert len(output.getvalue().split("\n")) == 7
+
+
+def test_skip_payload_truncated(tmp_path):
+    filename = str(tmp_path / "test.warc")
+    write_warc(filename, False)
+
+    with open(filename, "r+b") as fh:
+        fh.truncate(os.path.getsize(filename) - 50000)
+
+    offsets, skipped = get_offsets(filename, SkippingArchiveIterator)
+    assert offsets == get_offsets(filename, ArchiveIterator)[0]
+    assert skipped > 500000
+
+    output = StringIO()
+    write_cdx_index(output, filename, {})
+
+    full_output = StringIO()
+    write_cdx_index(full_output, filename, dict(skip_payload=False))
+
+    assert output.getvalue() == full_output.getvalue()
+
+
+def test_skip_payload_test_files():
+    for post_append in (False, True):
+        output = StringIO()
+        write_cdx_index(output, TEST_DIR, dict(post_append=post_append))
+
+        full_output = StringIO()
+        opts = dict(post_append=post_append, skip_payload=False)
+        write_cdx_index(full_output, TEST_DIR, opts)
+
+        assert output.getvalue() == full_output.getvalue()
+
+
+def test_skip_payload_unknown_reader_state(tmp_path, monkeypatch):
+    filename = str(tmp_path / "test.warc.gz")
+    write_warc(filename, True)
+
+    # records are read in full if warcio reader state changes
+    monkeypatch.setattr(
+        "cdxj_indexer.skipiter.READER_STATE", READER_STATE + ("missing",)
+    )
+
+    offsets, skipped = get_offsets(filename, SkippingArchiveIterator)
+    assert offsets == get_offsets(filename, ArchiveIterator)[0]
+    assert skipped == 0